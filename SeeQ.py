@@ -8,34 +8,40 @@ SeeQ is basically a python library that provides a set of classes and functions
 Classes: 
 -        CQ: Master CQ class
 -   GraphCQ: CQ Subclass representing how a CQ can be found in a graph (implemented as a SHACL shape) 
+- ShapePattern: Compact, immutable pattern of the SHACL shape of a GraphCQ
 - VirtualCQ: CQ Subclass representing computations 
 - DefaultCQ: CQ Subclass representing default values or thresholds
--    CalcCQ : Only used internally to perform calculations between CQ objects
+-    CalcCQ : Only used internally to perform calculations between CQ objects (lazily, as an expression tree)
+-    Window : A Calc over a window of past samples (rolling mean/min/max, persistence, hysteresis)
 
 Functions: 
--       batched: Gabe's technicality
--       get_cqs: Used internally to return the CQs of each application
-- is_applicable: Checking whether CQs can be found in a graph
--       resolve: Used to resolve and execute each application
+-          batched: Gabe's technicality
+-          get_cqs: Used internally to return the CQs of each application
+-    working_graph: The part of a graph that the CQs of some applications can match
+-    is_applicable: Checking whether CQs can be found in a graph
+-          resolve: Used to resolve and execute each application
+-     resolve_many: Same as resolve, for many applications sharing CQs
+- resolve_bindings: Same as resolve_many, returning plain {target: {CQ name: point}} bindings
+-         evaluate: Evaluates a CQ expression over numbers, arrays or dataframe columns
+-          execute: Executes a resolved application over a dataframe
 '''
+__version__ = "0.2.0"
+
 from functools import partial
+import operator
 from itertools import islice
-from collections import defaultdict
 import inspect
+import weakref
 from typing import Tuple, Callable, List, Dict
-from rdflib import Namespace, Graph, BNode, Literal, URIRef
-from rdflib.term import Node
 from dataclasses import dataclass, field
-from shape_to_query import shape_to_query
-import pyshacl
-from typing import Literal, Tuple, Callable
-from rdflib import Namespace, Graph, BNode, Literal, URIRef
 import numpy as np
-from sympy import*
-from rdflib.collection import Collection
-from rdflib.paths import AlternativePath, SequencePath
-from dataclasses import dataclass, field
-import pyshacl
+from rdflib import Namespace, Graph, BNode, Literal, URIRef
+from rdflib.term import Node
+from shape_to_query import pattern_to_query, pattern_to_where, union_query, compile_query
+from graph_index import ClassHierarchy, graph_cache, graph_parts, hierarchy_for, index_for, match_pattern, point_order, prune_graph
+import windows
+# pyshacl (and owlrl through it) is slow to import, and only needed by strict validation:
+# it is imported by GraphCQ.qualify(strict=True)
 
 # Definition of namespaces
 BRICK = Namespace("https://brickschema.org/schema/Brick#")
@@ -50,7 +56,7 @@ REF = Namespace("https://brickschema.org/schema/Brick/ref#")
 BACNET = Namespace("https://brickschema.org/schema/Bacnet")
 A = RDF.type
 
-@dataclass
+@dataclass(eq=False)
 class CQ:
     '''
     This is the master class used to define CQ objects. 
@@ -69,120 +75,179 @@ class CQ:
     def __post_init__(self):
         self.value = np.NaN
         self.description = self.description.replace(" ", "_")
+        # prepared queries without hierarchy, and per hierarchy (weakly, so that the
+        # hierarchies of dropped graphs are freed)
+        self._plain = {}
+        self._compiled = weakref.WeakKeyDictionary()
 
     def __add__(self, other):
         '''
-        A magic function performing addition between CQ objects or numbers. 
-        The implementation is slightly weird: 
-        
+        A magic function performing addition between CQ objects or numbers.
+        The implementation is lazy:
+
         Every time a magic function is used, a "Calc" object is created which
-        can store the value that we want to retrieve. 
+        stores the operation and its two operands, without computing anything.
         The function returns a Calc object which can then be reused to perform
-        another calculation. For example: 
-        Tma + Tsa + Tra is performed as (1) Tma + Tsa -> returns a Calc object 
-        with value 100, (2) 100 + Tra returns again a Calc object. 
+        another calculation. For example:
+        Tma + Tsa + Tra is built as (1) Tma + Tsa -> returns a Calc object,
+        (2) <Calc> + Tra returns again a Calc object.
 
-        In this way, we can use CQ objects in equations.       
-        Calc objects are designed be used for calculations (check below). 
+        In this way, we can use CQ objects in equations. The resulting expression
+        tree is computed in one vectorized pass with evaluate() (check below),
+        once the CQs are bound to arrays or dataframe columns.
         '''
-        r = Calc(self, other)
-        r.value = r.cq1val + r.cq2val
-        return r
+        return Calc(self, other, 'add')
 
     def __radd__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val + r.cq2val
-        return r
+        return Calc(other, self, 'add')
 
     def __sub__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val - r.cq2val
-        return r
+        return Calc(self, other, 'sub')
 
     def __rsub__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val - r.cq2val
-        return r
+        return Calc(other, self, 'sub')
 
     def __mul__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val * r.cq2val
-        return r
+        return Calc(self, other, 'mul')
 
     def __rmul__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val * r.cq2val
-        return r
+        return Calc(other, self, 'mul')
 
     def __truediv__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val / r.cq2val
-        return r
+        return Calc(self, other, 'truediv')
 
     def __rtruediv__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val / r.cq2val
-        return r
+        return Calc(other, self, 'truediv')
 
     def __lt__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val < r.cq2val
-        return r
+        return Calc(self, other, 'lt')
 
     def __rlt__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val < r.cq2val
-        return r
+        return Calc(other, self, 'lt')
 
     def __le__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val <= r.cq2val
-        return r
+        return Calc(self, other, 'le')
 
     def __rle__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val <= r.cq2val
-        return r
+        return Calc(other, self, 'le')
 
     def __gt__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val > r.cq2val
-        return r
+        return Calc(self, other, 'gt')
 
     def __rgt__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val > r.cq2val
-        return r
+        return Calc(other, self, 'gt')
 
     def __ge__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val >= r.cq2val
-        return r
+        return Calc(self, other, 'ge')
 
     def __rge__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val >= r.cq2val
-        return r
+        return Calc(other, self, 'ge')
 
     def __and__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val and r.cq2val
-        return r
+        # elementwise logical and, so that it works over arrays
+        return Calc(self, other, 'and')
 
     def __rand__(self, other):
-        r = Calc(self, other)
-        r.value = r.cq1val and r.cq2val
-        return r
+        return Calc(other, self, 'and')
 
     def __abs__(self):
-        r = Calc(self, None)
-        r.value = r.cq1val
-        return r
+        return Calc(self, None, 'abs')
+
+    # Window operators: the result at each sample depends on the previous samples
+    # (windows are counted in samples, check windows.py)
+    def rolling_mean(self, size: int):
+        return Window(self, size, 'rolling_mean')
+
+    def rolling_min(self, size: int):
+        return Window(self, size, 'rolling_min')
+
+    def rolling_max(self, size: int):
+        return Window(self, size, 'rolling_max')
+
+    def duration(self):
+        # number of consecutive samples for which the condition has been true
+        return Window(self, None, 'duration')
+
+    def persists(self, size: int):
+        # e.g. (mat > sat + eps).persists(15): the fault lasted for at least 15 samples
+        return Window(self, size, 'persists')
+
+    def hysteresis(self, on, off):
+        # e.g. (mat - sat).hysteresis(Epsilon_t, Epsilon_t / 2): true from where the
+        # difference rises above Epsilon_t until it falls below Epsilon_t / 2
+        return Window(self, None, 'hysteresis', (on, off))
     
     def __call__(self, g:Graph):
         res = self.resolve(g)
         return res
 
+    @property
+    def key(self) -> Tuple:
+        """
+        A hashable key identifying the implementations of the CQ, in order: two CQs with
+        the same key resolve to the same points
+        """
+        return tuple(impl.key if isinstance(impl, GraphCQ) else ('default', impl.value)
+                     for impl in self.implementation)
+
+    def ranked(self, g: Graph, hierarchy: ClassHierarchy = None, engine: str = "sparql", stats=None) -> Tuple:
+        """
+        Resolves all the implementations of the CQ at once, and returns (best, default):
+        - best: {target: (index of its best implementation, point)}, over the GraphCQ
+          implementations listed before the first DefaultCQ (the later ones never win),
+        - default: (index, value) of that first DefaultCQ, or None.
+
+        With engine="sparql", the GraphCQs are compiled into one UNION query whose rows
+        carry the index of their implementation (see union_query), so the graph is
+        queried once per CQ instead of once per implementation. The native engine
+        matches the implementations one by one over the index of the graph.
+        With `stats`, the SPARQL engine also runs the implementations one by one, so
+        that the cost of each one is recorded (see instrumentation.py)
+        """
+        graphs, default = [], None
+        for index, impl in enumerate(self.implementation):
+            if isinstance(impl, DefaultCQ):
+                default = (index, impl.value)
+                break
+            graphs.append((index, impl))
+
+        best = {}
+        if engine == "native" or (engine == "sparql" and stats is not None):
+            # the earlier implementations overwrite the later ones
+            for index, impl in reversed(graphs):
+                best.update((target, (index, point))
+                            for target, point in impl.candidates(g, hierarchy, engine, stats=stats).items())
+        elif engine == "sparql":
+            if not graphs:
+                return best, default
+            for row in g.query(self.compile_union(graphs, hierarchy)):
+                index, target, point = int(row['impl']), row['target'], row.get('point')
+                # within an implementation the first point by point_order wins, as in GraphCQ.candidates
+                if target not in best or (index, point_order(point)) < (best[target][0], point_order(best[target][1])):
+                    best[target] = (index, point)
+        else:
+            raise ValueError(f"unknown engine {engine!r}")
+        return best, default
+
+    def compile_union(self, graphs: List, hierarchy: ClassHierarchy = None):
+        """
+        The prepared UNION query of the GraphCQs `graphs` ([(index, GraphCQ)]) of the CQ,
+        generated once per hierarchy
+        """
+        compiled = self._plain if hierarchy is None else self._compiled.setdefault(hierarchy, {})
+        if 'union' not in compiled:
+            branches = [(index, pattern_to_where(*impl.pattern, hierarchy=hierarchy)[0]) for index, impl in graphs]
+            compiled['union'] = compile_query(union_query(branches))
+        return compiled['union']
+
+    def qualify(self, graph: Graph, strict: bool = False, engine: str = "sparql") -> bool:
+        """
+        A CQ can be found in a graph if any of its implementations can. Implementations
+        which are not GraphCQs (e.g. DefaultCQ values) are always available
+        """
+        return any(impl.qualify(graph, strict, engine) if hasattr(impl, 'qualify') else True
+                   for impl in self.implementation)
+
 def batched(iterable, n):
     "Batch data into tuples of length n. The last batch may be shorter."
     # batched('ABCDEFG', 3) --> ABC DEF G
@@ -193,11 +258,87 @@ def batched(iterable, n):
         yield batch
 
 
-@dataclass
+class ShapePattern:
+    """
+    The shape of a GraphCQ in a compact, immutable form:
+    - targets: the target classes (one per pattern given to GraphCQ, usually just one)
+    - steps:   the (path, class) pairs, each a property of the target
+    - points:  the indexes of the steps whose object is the point
+
+    e.g. GraphCQ(1, [BRICK.AHU, BRICK.hasPart, BRICK.Fan, BRICK.hasPoint, BRICK.Supply_Air_Temperature_Sensor])
+    -> targets=(brick:AHU,), steps=((brick:hasPart, brick:Fan), (brick:hasPoint, brick:Supply_Air_Temperature_Sensor)), points=(1,)
+
+    Patterns are hashable and compare by value. The SHACL shape is only built by shape()
+    """
+    __slots__ = ('targets', 'steps', 'points')
+
+    def __init__(self, targets: Tuple[Node, ...], steps: Tuple[Tuple[Node, Node], ...], points: Tuple[int, ...]):
+        object.__setattr__(self, 'targets', tuple(targets))
+        object.__setattr__(self, 'steps', tuple(tuple(step) for step in steps))
+        object.__setattr__(self, 'points', tuple(points))
+
+    @classmethod
+    def from_patterns(cls, point: int, patterns) -> "ShapePattern":
+        # the lists given to GraphCQ: [targetClass, path1, class1, path2, class2, ...]. The
+        # point index counts the (path, class) pairs of each list
+        targets, steps, points = [], [], []
+        for pattern in patterns:
+            if len(pattern) >= 1 and pattern[0]:
+                targets.append(pattern[0])
+            for idx, step in enumerate(zip(pattern[1::2], pattern[2::2])):
+                if idx == point:
+                    points.append(len(steps))
+                steps.append(step)
+        return cls(targets, steps, points)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __iter__(self):
+        return iter((self.targets, self.steps, self.points))
+
+    def __reduce__(self):
+        return (type(self), tuple(self))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ShapePattern) and tuple(self) == tuple(other)
+
+    def __hash__(self) -> int:
+        return hash(tuple(self))
+
+    def __repr__(self) -> str:
+        return f"ShapePattern(targets={self.targets!r}, steps={self.steps!r}, points={self.points!r})"
+
+    def shape(self, name: URIRef) -> Graph:
+        """
+        Builds the SHACL node shape `name` of the pattern:
+
+        <name> a sh:NodeShape ; sh:targetClass <target> ;
+            sh:property [ sh:path <path> ; sh:qualifiedValueShape [ sh:class <class> ] ;
+                          sh:qualifiedMinCount 1 ; (sh:name "point" ;) ] ...
+        """
+        shape = Graph()
+        shape.add((name, A, SH.NodeShape))
+        for target in self.targets:
+            shape.add((name, SH.targetClass, target))
+        for idx, (prop, classname) in enumerate(self.steps):
+            pshape = BNode()
+            tshape = BNode()
+            shape.add((name, SH.property, pshape))
+            shape.add((pshape, SH.path, prop))
+            shape.add((pshape, SH.qualifiedValueShape, tshape))
+            shape.add((tshape, SH["class"], classname))
+            shape.add((pshape, SH.qualifiedMinCount, Literal(1)))
+            if idx in self.points:
+                shape.add((pshape, SH.name, Literal("point")))
+        return shape
+
+
+@dataclass(eq=False)
 class GraphCQ(CQ):
     """
     Instantiating a GraphCQ object: 
-    (1) we create a SHACL shape that will be used for validation over a graph input 
+    (1) we keep the pattern of a SHACL shape (see ShapePattern), which can be built as a shape graph for validation over a graph input 
     (2) we generate a SPARQL query that will support the retrieval of the uri if the shape is valid (using Gabe's shape-to-query component)
     """
     description: str = "GraphCQ"
@@ -223,26 +364,48 @@ class GraphCQ(CQ):
         GraphCQ(0, [BRICK.AHU, BRICK.hasPoint, BRICK.Sensor]) -> will retrieve the "sensor" value
         GraphCQ(1, [BRICK.AHU, BRICK.hasPoint, BRICK.Sensor, BRICk.hasPoint, BRICK.Setpoint]) -> will retrieve the "setpoint" value
         """
-        self.shape = Graph()
-        self.query = ""
+        self.point = point
+        self.pattern = ShapePattern.from_patterns(point, patterns)
+        # prepared queries without hierarchy, and per hierarchy (weakly, so that the
+        # hierarchies of dropped graphs are freed)
+        self._plain = {}
+        self._compiled = weakref.WeakKeyDictionary()
         self.description = '_'.join(x.fragment for sublist in patterns for x in sublist)
-        shape = GCQ[self.description]
-        self.shape.add((shape, A, SH.NodeShape))
 
-        for pattern in patterns:
-            if len(pattern) >= 1 and pattern[0]:
-                self.shape.add((shape, SH.targetClass, pattern[0]))
-            if len(pattern) >= 3:
-                for idx, (prop, classname) in enumerate(batched(pattern[1:], 2)):
-                    pshape = BNode()
-                    tshape = BNode()
-                    self.shape.add((shape, SH.property, pshape))
-                    self.shape.add((pshape, SH.path, prop))
-                    self.shape.add((pshape, SH.qualifiedValueShape, tshape))
-                    self.shape.add((tshape, SH["class"], classname))
-                    self.shape.add((pshape, SH.qualifiedMinCount, Literal(1)))
-                    if idx == point:
-                        self.shape.add((pshape, SH.name, Literal("point")))
+    @property
+    def shape(self) -> Graph:
+        """
+        The SHACL shape of the pattern, e.g. to validate a graph (qualify(strict=True))
+        or to serialize it. The shape graph is built on every access and not kept: the
+        queries are generated from the pattern directly
+        """
+        return self.pattern.shape(GCQ[self.description])
+
+    @property
+    def compiled(self):
+        """
+        The prepared SPARQL query of the shape. It is generated once per GraphCQ, and
+        GraphCQs with the same shape share the same prepared query (see compile_query)
+        """
+        return self.compile()
+
+    @property
+    def key(self) -> Tuple:
+        """
+        A hashable key identifying the shape: two GraphCQs with the same key match the same nodes
+        """
+        return (self.point, self.pattern)
+
+    def compile(self, hierarchy: ClassHierarchy = None, ask: bool = False):
+        """
+        Same as compiled, but class membership is checked against the precomputed
+        subclasses of a ClassHierarchy instead of the rdfs:subClassOf* path.
+        With ask=True, the ASK version of the query is returned
+        """
+        compiled = self._plain if hierarchy is None else self._compiled.setdefault(hierarchy, {})
+        if ask not in compiled:
+            compiled[ask] = compile_query(pattern_to_query(*self.pattern, hierarchy=hierarchy, ask=ask))
+        return compiled[ask]
 
     def join_candidates(self, g: Graph) -> List[Node]:
         """
@@ -274,68 +437,123 @@ class GraphCQ(CQ):
             ?point a brick:Supply_Air_Temperature_Sensor .
         }
         """
-        self.query = shape_to_query(self.shape, GCQ[self.description])
-        res = g.query(self.query)
-        self.query = res
-        targets = set(row['target'] for row in res)
-        return targets
+        return set(self.candidates(g))
 
-    def qualify(self, graph: Graph) -> bool:
+    def candidates(self, g: Graph, hierarchy: ClassHierarchy = None, engine: str = "sparql", targets=None,
+                   stats=None) -> Dict:
+        """
+        Runs the query of the shape once (no bindings) and indexes the result
+        rows as {target: point}. When a target matches more than one point, the
+        first one by graph_index.point_order wins, with both engines.
+
+        engine="native" evaluates the patterns with match_pattern over the
+        GraphIndex of the graph instead of the SPARQL engine.
+        `targets` restricts the candidates to the given nodes (one query per target).
+        `stats` is an optional ResolutionStats (see instrumentation.py)
         """
-        Returns true if the CQ can resolve on the given graph
+        if engine not in ("native", "sparql"):
+            raise ValueError(f"unknown engine {engine!r}")
+        if stats is not None:
+            start = stats.now()
+        # "generation": the query, or the index of the graph for the native engine
+        prepared = index_for(g) if engine == "native" else self.compile(hierarchy)
+        if stats is not None:
+            generated = stats.now()
+        index = {}
+        rows = 0
+        if engine == "native":
+            index = dict(match_pattern(prepared, self.pattern, targets))
+            rows = len(index)
+        elif targets is not None:
+            for target in targets:
+                for row in g.query(prepared, initBindings={'target': target}):
+                    point = row.get('point')
+                    if target not in index or point_order(point) < point_order(index[target]):
+                        index[target] = point
+                    rows += 1
+        else:
+            for row in g.query(prepared):
+                target, point = row['target'], row.get('point')
+                if target not in index or point_order(point) < point_order(index[target]):
+                    index[target] = point
+                rows += 1
+        if stats is not None:
+            stats.implementation(self, engine, generated - start, stats.now() - generated, rows, len(index),
+                                 None if targets is None else len(targets))
+        return index
+
+    def qualify(self, graph: Graph, strict: bool = False, engine: str = "sparql") -> bool:
         """
-        result = pyshacl.validate(data_graph=graph, shacl_graph=self.shape)
-        return result[0]
+        Returns true if the CQ can resolve on the given graph, i.e. if the shape
+        has at least one match. The check stops at the first match (ASK query, or
+        the native matcher with engine="native"), and it is memoized until the graph
+        changes (see graph_index.graph_version: graphs in other stores than rdflib's
+        Memory must be passed to graph_index.invalidate after they are changed).
+
+        With strict=True, the graph is validated against the SHACL shape with pyshacl
+        """
+        cache = graph_cache(graph).setdefault('qualify', {})
+        key = (self.key, strict, engine)
+        if key not in cache:
+            if strict:
+                import pyshacl
+                # pyshacl needs plain graphs: the ontology of a union view is passed separately
+                building, ontology = graph_parts(graph)
+                if building is ontology:
+                    cache[key] = pyshacl.validate(data_graph=graph, shacl_graph=self.shape)[0]
+                else:
+                    cache[key] = pyshacl.validate(data_graph=building, shacl_graph=self.shape, ont_graph=ontology)[0]
+            elif engine == "native":
+                cache[key] = next(match_pattern(index_for(graph), self.pattern), None) is not None
+            elif engine == "sparql":
+                cache[key] = graph.query(self.compile(ask=True)).askAnswer
+            else:
+                raise ValueError(f"unknown engine {engine!r}")
+        return cache[key]
 
     def resolve(self, g: Graph, bindings) -> Node:
-        self.query = shape_to_query(self.shape, GCQ[self.description])
-        res = list(g.query(self.query, initBindings=bindings))
-        row = res[0]
+        res = list(g.query(self.compiled, initBindings=bindings))
         # TODO: get an actual value?
-        return row['point']
-
-@dataclass
+        return min((row['point'] for row in res), key=point_order)
+
+# The operations that a Calc object can represent, as functions over numbers,
+# NumPy arrays or pandas Series
+OPERATORS = {
+    'add': operator.add,
+    'sub': operator.sub,
+    'mul': operator.mul,
+    'truediv': operator.truediv,
+    'lt': operator.lt,
+    'le': operator.le,
+    'gt': operator.gt,
+    'ge': operator.ge,
+    'and': np.logical_and,
+    'abs': lambda a, _: np.abs(a),
+}
+
+@dataclass(eq=False)
 class Calc(CQ):
     """
     A class supporting calculations through python's magic methods. Calc objects are created automatically when we use the magic functions of the class CQ.
     
     The purpose of this implementation is to enable calculations between CQ objects as python does with numbers. For example: 
     if Tma and Tsa are CQ objects, we can write: 
-    Tma + Tsa - 100 and retrieve:
-    Tma.value + Tsa.value - 100 = <some number>
+    Tma + Tsa - 100 and retrieve a Calc object Calc(Calc(Tma, Tsa, 'add'), 100, 'sub')
 
-    where Tma.value, Tsa.value should (yet to implement) provide the actual value retrieved at a specific time for Tma.
+    A Calc object is a node of a lazy expression tree: nothing is computed until the tree
+    is evaluated (see evaluate below) with values for Tma and Tsa, e.g. NumPy arrays or
+    the columns of a dataframe.
     """
     description: str = field(init=False, repr=False)
     implementation: list = field(init=False)
-    value: str = field(init=False)
     unit: UNIT = field(init=False, repr=False)
-    cq1val: float = field(init=False)
-    cq1val: float = field(init=False)
     cq1: CQ
     cq2: CQ
+    op: str
 
     def __post_init__(self):
-        self.cq1val = np.NaN
-        self.cq2val = np.NaN
         self.implementation = []
-        self.value = np.NaN
 
-        if isinstance(self.cq1, CQ) and isinstance(self.cq2, CQ):
-            self.cq1val = self.cq1.value
-            self.cq2val = self.cq2.value
-        elif isinstance(self.cq1, float) and isinstance(self.cq2, CQ):
-            self.cq1val = self.cq1
-            self.cq2val = self.cq2.value
-        elif isinstance(self.cq1, CQ) and isinstance(self.cq2, float):
-            self.cq1val = self.cq1.value
-            self.cq2val = self.cq2
-        elif isinstance(self.cq1, int) and isinstance(self.cq2, CQ):
-            self.cq1val = float(self.cq1)
-            self.cq2val = self.cq2.value
-        elif isinstance(self.cq1, CQ) and isinstance(self.cq2, int):
-            self.cq1val = self.cq1.value
-            self.cq2val = float(self.cq2)
         if not(isinstance(self.cq2, (Calc, float, int, type(None)))):
             self.implementation.append(self.cq2)
         if not(isinstance(self.cq1, (Calc, float, int, type(None)))):
@@ -345,7 +563,39 @@ class Calc(CQ):
         if isinstance(self.cq2, Calc):
             self.implementation.extend(self.cq2.implementation)
 
-@dataclass
+    @property
+    def value(self):
+        # the scalar value of the expression, from the .value of its CQs
+        return evaluate(self)
+
+    def evaluate(self, data: Dict = None):
+        return evaluate(self, data)
+
+    def qualify(self, graph: Graph, strict: bool = False, engine: str = "sparql") -> bool:
+        # the implementation of a Calc holds its operands, which are all needed
+        return all(cq.qualify(graph, strict, engine) for cq in self.implementation)
+
+@dataclass(eq=False)
+class Window(Calc):
+    """
+    A Calc whose result at each sample depends on the previous samples of its operand:
+    cq1 is the operand, cq2 the window size (or None), op one of the functions of
+    windows.py, and args the other parameters of the operation (sizes, or thresholds
+    which can be CQs, e.g. Epsilon_t).
+
+    Window objects carry a state across the chunks of a series: check evaluate below.
+    """
+    args: tuple = ()
+
+    def __post_init__(self):
+        super().__post_init__()
+        for arg in self.args:
+            if isinstance(arg, Calc):
+                self.implementation.extend(arg.implementation)
+            elif not isinstance(arg, (float, int, type(None))):
+                self.implementation.append(arg)
+
+@dataclass(eq=False)
 class VirtualCQ(CQ):
     description: str = field(init=False, repr=False)
     unit: UNIT.unit = field(init=False, repr=False)
@@ -353,10 +603,15 @@ class VirtualCQ(CQ):
     value: float
 
     def __post_init__(self):
-        self.implementation = self.value.implementation
-        self.value = self.value.value
+        self.expression = self.value
+        self.implementation = self.expression.implementation
+        self.value = self.expression.value
 
-@dataclass
+    def qualify(self, graph: Graph, strict: bool = False, engine: str = "sparql") -> bool:
+        # as for Calc, the implementation holds the operands of the computation
+        return all(cq.qualify(graph, strict, engine) for cq in self.implementation)
+
+@dataclass(eq=False)
 class DefaultCQ(CQ):
     description: str = field(init=False, repr=False)
     unit: UNIT.unit = field(init=False, repr=False)
@@ -367,6 +622,98 @@ class DefaultCQ(CQ):
         self.implementation = [self.value]
 
 
+def _window(node: Window, x, params: list, state: Dict):
+    # applies a window operation along the last (time) axis, keeping its state in `state`
+    fn = getattr(windows, node.op)
+    if node.cq2 is not None:
+        params = [node.cq2] + params
+    if np.ndim(x) == 0:
+        # a scalar (e.g. the .value of the expression) is a series of one sample
+        return fn(np.atleast_1d(x), *params)[0][0]
+    if state is None:
+        result = fn(x, *params)[0]
+    else:
+        result, state[node] = fn(x, *params, state=state.get(node))
+    if hasattr(x, 'index') and np.ndim(x) == 1:
+        # keep the index of pandas Series, as the pointwise operations do
+        result = type(x)(result, index=x.index)
+    return result
+
+def evaluate(expr, data: Dict = None, state: Dict = None):
+    """
+    Evaluates a CQ expression (a tree of Calc objects built by the magic functions of CQ)
+    in one pass. `data` maps the CQs of the expression to their values, which can be
+    numbers, NumPy arrays or pandas Series (e.g. the columns of a dataframe); every
+    operation is then computed once over the whole array.
+
+    CQs without data fall back to their DefaultCQ implementation, if any, and
+    otherwise to their scalar .value
+
+    Window operations are computed along the last axis of their operand. To evaluate an
+    expression over consecutive chunks of a series, pass the same `state` dictionary
+    (initially empty) for every chunk: the windows then continue from the previous chunk,
+    and the results are the same as over the whole series
+    """
+    data = data or {}
+    computed = {}
+
+    def _evaluate(node):
+        if id(node) in computed:
+            return computed[id(node)]
+        if isinstance(node, Window):
+            params = [_evaluate(arg) for arg in node.args]
+            result = _window(node, _evaluate(node.cq1), params, state)
+        elif isinstance(node, Calc):
+            result = OPERATORS[node.op](_evaluate(node.cq1), _evaluate(node.cq2))
+        elif isinstance(node, VirtualCQ):
+            result = _evaluate(node.expression)
+        elif isinstance(node, CQ):
+            if node in data:
+                result = data[node]
+            else:
+                defaults = [impl for impl in node.implementation if isinstance(impl, DefaultCQ)]
+                result = defaults[0].value if defaults else node.value
+        else:
+            # a number, or None for the missing operand of abs()
+            result = node
+        computed[id(node)] = result
+        return result
+
+    return _evaluate(expr)
+
+def execute(resolved: partial, data) -> object:
+    """
+    Executes an application resolved by resolve() over data, in one vectorized pass.
+    `data` maps the resolved points to their values, e.g. a dataframe with one
+    column per point; points are looked up by URIRef, then by the string of their URI.
+    A KeyError is raised if a resolved point has no data.
+
+    The application function is called with its CQs (the defaults of its parameters),
+    which builds the expression tree of the application; each CQ is then bound to the
+    data of the point that it was resolved to.
+
+    def rule(g, sat=AHU_Tsa, mat=AHU_Tma):
+        return mat < sat + Epsilon_t
+
+    for fn in resolve(g, rule):
+        faults = execute(fn, df)
+    """
+    fn, g = resolved.func, resolved.args[0]
+    cqs = get_cqs(fn)
+    values = {}
+    for name, cq in cqs.items():
+        point = resolved.keywords.get(name)
+        if not isinstance(point, Node):
+            # a default value
+            continue
+        for key in (point, str(point)):
+            if key in data:
+                values[cq] = data[key]
+                break
+        else:
+            raise KeyError(f"no data for point {point} of {name}")
+    return evaluate(fn(g), values)
+
 
 def get_cqs(fn: Callable) -> Dict:
     """
@@ -378,54 +725,171 @@ def get_cqs(fn: Callable) -> Dict:
             cqs[param.name] = param.default
     return cqs
 
-def is_applicable(g: Graph, fn: Callable) -> bool:
+def working_graph(g: Graph, fns: List[Callable]) -> Graph:
+    """
+    Returns the pruned graph on which the applications resolve like on `g`: the
+    triples that the GraphCQs of their CQs can match, and the slice of the class
+    hierarchy that they need (see graph_index.prune_graph). It is built once per set of
+    patterns and version of `g`
+    """
+    patterns = frozenset(impl.pattern for fn in fns for cq in get_cqs(fn).values()
+                         for impl in cq.implementation if isinstance(impl, GraphCQ))
+    cache = graph_cache(g).setdefault('working', {})
+    if patterns not in cache:
+        cache[patterns] = prune_graph(g, patterns)
+    return cache[patterns]
+
+def is_applicable(g: Graph, fn: Callable, strict: bool = False, engine: str = "sparql") -> bool:
+    """
+    Checks whether all the CQs of the function can be found in the graph.
+    By default this is an existence check per GraphCQ (see GraphCQ.qualify);
+    strict=True validates the SHACL shapes with pyshacl instead
+    """
     cqs: Dict[str, CQ] = get_cqs(fn)
     for cq in cqs.values():
-        if hasattr(cq, 'qualify') and not cq.qualify(g):
+        if hasattr(cq, 'qualify') and not cq.qualify(g, strict, engine):
             return False
     return True
 
-def resolve(g: Graph, fn: Callable) -> List[Callable]:
+def _get_candidates(g: Graph, cqs: Dict, hierarchy: ClassHierarchy, engine: str, computed: Dict = None,
+                    stats=None) -> Dict:
     """
-    Given a graph and a function which uses CQs, generates
-    a copy of the function w/ the CQs resolved to some values
-    """
-    cqs: Dict[str, CQ] = get_cqs(fn)
+    For each CQ, get the best implementation and point of every target, as
+    {CQ name: (best, default)} (see CQ.ranked). This helps us join multiple CQ
+    resolutions together, and it means that the implementations of a CQ are
+    resolved once, in one query, no matter how many targets there are.
 
-    # for each implementation, get all of the values of the 'target'
-    # variable. This helps us join multiple CQ resolutions together
-    candidates = defaultdict(list)
+    `computed` holds the candidates of CQs which were already resolved on this
+    graph (by CQ.key), so that they are shared across applications
+    """
+    computed = {} if computed is None else computed
+    candidates = {}
     for name, cq in cqs.items():
-        for impl in cq.implementation:
-            candidates[name].append(impl.join_candidates(g))
+        if cq.key not in computed:
+            computed[cq.key] = cq.ranked(g, hierarchy, engine, stats)
+        candidates[name] = computed[cq.key]
+    return candidates
 
-    # for a given target node (e.g. an AHU instance), gets the
+def _bind(cqs: Dict, candidates: Dict, targets=None, chosen: Dict = None, failures: Dict = None) -> Dict:
+    """
+    Returns {target: {CQ name: resolved point or default value}} for every
+    target on which all the CQs of the application resolve.
+    `candidates` is {CQ name: (best, default)}, as returned by _get_candidates.
+    `targets` restricts the binding to the given nodes.
+    `chosen` is filled with {target: {CQ name: index of the chosen implementation}},
+    and `failures` with {target: [names of the CQs which do not resolve]}
+    """
+    # for a given target node (e.g. an AHU instance), gets the point of the
     # best implementation for all CQs in the function. The "best"
     # implementation is the one that appears earliest in the implementation list
     def get_best_implementation(target: Node) -> Dict:
         best_impl = {}
-        for name, candidate_list in candidates.items():
-            for idx, candidate_impl in enumerate(candidate_list):
-                if target in candidate_impl:
-                    best_impl[name] = cqs[name].implementation[idx]
-                    break
+        for name, (best, default) in candidates.items():
+            if target in best:
+                index, best_impl[name] = best[target]
+            elif default is not None:
+                index, best_impl[name] = default
+            else:
+                continue
+            if chosen is not None:
+                chosen.setdefault(target, {})[name] = index
         return best_impl
 
     # figure out all possible targets
     all_targets = set()
-    for candidate_list in candidates.values():
-        for s in candidate_list:
-            all_targets.update(s)
+    for best, _ in candidates.values():
+        all_targets.update(best)
+    if targets is not None:
+        all_targets &= set(targets)
 
-    resolved = []
+    bindings = {}
     for target in all_targets:
         best_impl = get_best_implementation(target)
         if len(best_impl) != len(cqs):
             print(f"CANNOT RUN RULE ON {target}")
+            if failures is not None:
+                failures[target] = [name for name in cqs if name not in best_impl]
             continue
-        impl = {k: v.resolve(g, {'target': target}) for k,v in best_impl.items()}
-        resolved.append(partial(fn, g, **impl)) 
+        bindings[target] = best_impl
+    return bindings
 
-    return resolved
+def resolve(g: Graph, fn: Callable, inference: bool = False, engine: str = "sparql", cache=None,
+            stats=None) -> List[Callable]:
+    """
+    Given a graph and a function which uses CQs, generates
+    a copy of the function w/ the CQs resolved to some values
+
+    With inference=True, the subclass closure of the graph is materialized once
+    (see graph_index.py) and the queries look up class membership in it.
+    With engine="native", the GraphCQs are matched over an index of the graph
+    instead of being queried through SPARQL (this implies the subclass closure)
+
+    `cache` is an optional ResolutionCache (see resolution_cache.py), which persists the
+    bindings on disk: they are reused as long as the graph and the CQs do not change.
+    `stats` is an optional ResolutionStats (see instrumentation.py), which records the cost
+    of each implementation and the reason why the application cannot run on a target
+    """
+    if cache is not None or stats is not None:
+        bindings = resolve_bindings(g, [fn], inference, engine, cache, stats)[fn]
+        return [partial(fn, g, **impl) for impl in bindings.values()]
+    cqs: Dict[str, CQ] = get_cqs(fn)
+    hierarchy = hierarchy_for(g) if inference else None
+    candidates = _get_candidates(g, cqs, hierarchy, engine)
+    return [partial(fn, g, **impl) for impl in _bind(cqs, candidates).values()]
+
+def resolve_bindings(g: Graph, fns: List[Callable], inference: bool = False, engine: str = "sparql", cache=None,
+                     stats=None, prune: bool = False) -> Dict:
+    """
+    Resolves many applications at once, and returns the bindings instead of resolved functions:
+    {fn: {target: {CQ name: resolved point or default value}}}.
+    Unlike the partials returned by resolve, the bindings do not hold the graph, and
+    can be stored or sent to other processes.
+
+    Applications often reuse the same CQs (e.g. AHU_Tsa); every distinct CQ is resolved
+    once on the graph and its candidates are shared by all the applications.
+    With a `cache` (see resolve), only the applications missing from the cache are resolved.
+    With `stats` (see resolve), the resolution of every application is recorded.
+    With prune=True, the CQs are resolved on the working graph of the applications (see
+    working_graph) instead of the whole graph; the cache is still looked up by `g`. This
+    mostly helps the SPARQL engine: the native engine only indexes what it needs already
+    """
+    working = None
+    computed = {}
+    bindings = {}
+    for fn in fns:
+        if stats is not None:
+            start = stats.now()
+        if cache is not None:
+            cached = cache.get(g, fn, inference, engine)
+            if cached is not None:
+                bindings[fn] = cached
+                if stats is not None:
+                    stats.rule(fn, get_cqs(fn), stats.now() - start, cached,
+                               cache.implementations(g, fn, inference, engine), {}, cached=True)
+                continue
+        if working is None:
+            # only built if an application is missing from the cache
+            working = working_graph(g, fns) if prune else g
+            # the hierarchy of `g` (for a union view, of the shared ontology) is the one
+            # the queries are compiled for, even on the working graph
+            hierarchy = hierarchy_for(g) if inference else None
+        cqs: Dict[str, CQ] = get_cqs(fn)
+        candidates = _get_candidates(working, cqs, hierarchy, engine, computed, stats)
+        chosen, failures = {}, {}
+        bindings[fn] = _bind(cqs, candidates, chosen=chosen, failures=failures)
+        if cache is not None:
+            cache.put(g, fn, inference, engine, bindings[fn], chosen)
+        if stats is not None:
+            stats.rule(fn, cqs, stats.now() - start, bindings[fn], chosen, failures)
+    return bindings
+
+def resolve_many(g: Graph, fns: List[Callable], inference: bool = False, engine: str = "sparql", cache=None,
+                 stats=None, prune: bool = False) -> Dict:
+    """
+    Same as resolve, for many applications at once: returns {fn: [resolved copies of fn]}.
+    The CQ implementations shared by the applications are resolved once (see resolve_bindings)
+    """
+    return {fn: [partial(fn, g, **impl) for impl in bindings.values()]
+            for fn, bindings in resolve_bindings(g, fns, inference, engine, cache, stats, prune).items()}
 
 # %%
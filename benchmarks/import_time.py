@@ -0,0 +1,62 @@
+'''
+Import-time budget of SeeQ: rule workers are launched per job, so the time to import
+SeeQ (and the CQ specifications) is paid by every job.
+
+    python benchmarks/import_time.py              # reports the import times
+    python benchmarks/import_time.py --budget 1   # and fails if one takes longer
+
+Imports each module in fresh interpreters (best of `--repeat`), and fails (exit code 1)
+if a module which SeeQ only needs for some features (e.g. pyshacl, for strict
+validation) was imported eagerly. This check does not depend on the machine; the
+wall-clock budget does (most of the time goes to numpy and rdflib), so it is only
+checked when `--budget` is given.
+
+Functions:
+- import_time: the time to import a module in a fresh interpreter
+-      loaded: the modules loaded by importing a module, among the given ones
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# loaded on first use only: strict validation (pyshacl, owlrl) and SPARQL queries
+LAZY = ["sympy", "pyshacl", "owlrl", "rdflib.plugins.sparql"]
+
+MODULES = ["SeeQ", "CQ_Specification"]
+
+
+def _run(code: str) -> str:
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT,
+                          check=True).stdout
+
+def import_time(module: str, repeat: int = 5) -> float:
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    return min(float(_run(code)) for _ in range(repeat))
+
+def loaded(module: str, names: List[str]) -> List[str]:
+    code = f"import sys, json, {module}; print(json.dumps([m for m in {names!r} if m in sys.modules]))"
+    return json.loads(_run(code))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=None,
+                        help="seconds allowed for each import (default: not checked)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    for module in MODULES:
+        seconds = import_time(module, args.repeat)
+        eager = loaded(module, LAZY)
+        ok = not eager and (args.budget is None or seconds <= args.budget)
+        failed |= not ok
+        budget = f" (budget {args.budget:.3f}s)" if args.budget is not None else ""
+        print(f"{module:20} {seconds:7.3f}s{budget}"
+              f"{'  eagerly imports ' + ', '.join(eager) if eager else ''}  {'ok' if ok else 'FAILED'}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,171 @@
+'''
+Benchmarks of resolution and execution over synthetic Brick models (see synthetic.py).
+
+    python benchmarks/run.py --ahus 100 --vavs 10 --output results.json
+    python benchmarks/run.py --ahus 100 --vavs 10 --compare results.json
+
+Times, for each engine (sparql and native), on a cold cache (a new view of the building
+and the shared ontology for every repetition):
+-   applicability: is_applicable of every benchmark rule
+-      candidates: the candidates of every distinct GraphCQ implementation (and their sizes)
+-      resolution: resolve_bindings of all the rules, and the time per resolved target
+-          pruned: resolve_bindings over the working graph of the rules (prune=True)
+and, once:
+-       execution: stream over synthetic series, columnar and target by target
+
+The best time of `--repeat` runs is kept. Results are written as JSON, together with
+the sizes of the model and the current git commit, and can be compared with the results
+of another commit with --compare.
+
+Functions:
+-     run: runs the benchmarks and returns the results as a dict
+- compare: prints the ratio of the timings of two results
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Callable, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from CQ_Specification import *
+from execution import points_of, stream
+from ontology import building_graph, load_ontology
+from timeseries import ArraySource
+from synthetic import generate_data, generate_model
+
+
+def ahu_mixing(g, sat=AHU_Tsa, mat=AHU_Tma, eps=Epsilon_t):
+    return mat > sat + eps
+
+def ahu_fan_heat(g, sat=AHU_Tsa, mat=AHU_Tma, rat=AHU_Tra, eps=Epsilon_t, fan=DelTsf):
+    return (sat - fan > mat + eps) & (rat < mat - eps)
+
+def vav_supply(g, tsa=VAV_Tsa, eps=Epsilon_t):
+    return (tsa > 30 + eps).persists(15)
+
+RULES = [ahu_mixing, ahu_fan_heat, vav_supply]
+
+
+def _best(fn: Callable, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+def run(ahus: int = 10, vavs: int = 5, zones: int = 2, days: int = 7, repeat: int = 3,
+        ontology: str = "Brick.ttl", seed: int = 0) -> Dict:
+    results = {
+        'meta': {
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'ahus': ahus, 'vavs': vavs, 'zones': zones, 'days': days, 'repeat': repeat, 'seed': seed,
+        },
+        'timings': {},
+        'counts': {},
+    }
+    timings, counts = results['timings'], results['counts']
+
+    start = time.perf_counter()
+    building = generate_model(ahus, vavs, zones, seed)
+    timings['generate'] = time.perf_counter() - start
+    counts['triples'] = len(building)
+    start = time.perf_counter()
+    brick = load_ontology(ontology)
+    timings['load_ontology'] = time.perf_counter() - start
+    counts['working_triples'] = len(working_graph(building_graph(building, brick), RULES))
+
+    implementations = {}
+    for fn in RULES:
+        for cq in get_cqs(fn).values():
+            for impl in cq.implementation:
+                if isinstance(impl, GraphCQ):
+                    implementations.setdefault(impl.key, impl)
+
+    # the rules print the targets on which they cannot run
+    with contextlib.redirect_stdout(io.StringIO()):
+        for engine in ("sparql", "native"):
+            def applicability():
+                g = building_graph(building, brick)
+                return [is_applicable(g, fn, engine=engine) for fn in RULES]
+            timings[f'{engine}/applicability'] = _best(applicability, repeat)
+
+            for n, impl in enumerate(implementations.values()):
+                def candidates():
+                    return impl.candidates(building_graph(building, brick), engine=engine)
+                timings[f'{engine}/candidates/{n}:{impl.description}'] = _best(candidates, repeat)
+                counts[f'candidates/{n}:{impl.description}'] = len(candidates())
+
+            def resolution():
+                return resolve_bindings(building_graph(building, brick), RULES, engine=engine)
+            timings[f'{engine}/resolution'] = _best(resolution, repeat)
+            bindings = resolution()
+            targets = sum(len(targets) for targets in bindings.values())
+            timings[f'{engine}/resolution_per_target'] = timings[f'{engine}/resolution'] / max(1, targets)
+
+            def pruned():
+                return resolve_bindings(building_graph(building, brick), RULES, engine=engine, prune=True)
+            timings[f'{engine}/pruned'] = _best(pruned, repeat)
+        counts.update({f'targets/{fn.__name__}': len(bindings[fn]) for fn in RULES})
+
+    g = building_graph(building, brick)
+    points = points_of(bindings)
+    samples = days * 1440
+    timestamps, values = generate_data(points, samples, 60.0, seed)
+    source = ArraySource(timestamps, values)
+    counts['points'] = len(points)
+    counts['samples'] = samples
+    for mode, by_target in (("columnar", False), ("by_target", True)):
+        def execution():
+            for _ in stream(g, RULES, source, 0, samples * 60.0, 86400, bindings=bindings, by_target=by_target):
+                pass
+        timings[f'execution/{mode}'] = _best(execution, repeat)
+    return results
+
+def compare(results: Dict, baseline: Dict) -> None:
+    print(f"{'timing':60} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, current in results['timings'].items():
+        base = baseline['timings'].get(name)
+        if base is None:
+            print(f"{name:60} {'-':>10} {current:10.4f}")
+        else:
+            print(f"{name:60} {base:10.4f} {current:10.4f} {current / base if base else float('inf'):7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ahus", type=int, default=10)
+    parser.add_argument("--vavs", type=int, default=5)
+    parser.add_argument("--zones", type=int, default=2)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ontology", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Brick.ttl"))
+    parser.add_argument("--output", help="file to write the results to (JSON)")
+    parser.add_argument("--compare", help="results of an earlier run (JSON) to compare with")
+    args = parser.parse_args()
+
+    results = run(args.ahus, args.vavs, args.zones, args.days, args.repeat, args.ontology, args.seed)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    else:
+        print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,99 @@
+'''
+Deterministic synthetic Brick models and time series, for the benchmarks.
+
+A model has `ahus` AHUs, each feeding `zones` zones and `vavs` VAVs. The points are
+laid out as the implementations of CQ_Specification.py expect, with variations chosen by
+a seeded random generator so that every implementation has candidates. As in the shapes
+of the implementations, every (path, class) pair is a property of the target (e.g. "AHU
+hasPart Fan, hasPoint Supply_Air_Temperature_Sensor"):
+
+- supply air temperature: AHU hasPoint, AHU feeds Zone, and for some AHUs AHU hasPart Fan
+- mixed air temperature:  AHU hasPoint, AHU feeds Zone, and for some AHUs AHU hasPart Mixed_Damper
+- return air temperature: AHU hasPoint, the sensor feeding a zone for some AHUs
+- VAVs: isPartOf their AHU, and most of them hasPoint a supply air temperature sensor
+
+A fraction `unmatched` of the AHU sensors only hang from a part of the AHU, which no
+implementation matches, so that some targets cannot be resolved.
+
+The same arguments always give the same graph (same node names, same triples).
+
+Functions:
+- generate_model: builds a synthetic building graph
+-  generate_data: builds synthetic series for the points of a model
+'''
+import random
+from typing import Dict, List, Tuple
+import numpy as np
+from rdflib import Graph, Namespace, RDF
+
+BRICK = Namespace("https://brickschema.org/schema/Brick#")
+SYN = Namespace("http://example.org/synthetic#")
+
+
+def generate_model(ahus: int = 10, vavs: int = 5, zones: int = 2, seed: int = 0, unmatched: float = 0.1) -> Graph:
+    """
+    Returns a building graph (without the Brick ontology) with `ahus` AHUs, each with
+    `vavs` VAVs and `zones` zones
+    """
+    rng = random.Random(seed)
+    g = Graph()
+    g.bind("brick", BRICK)
+    g.bind("syn", SYN)
+
+    for a in range(ahus):
+        ahu = SYN[f"AHU_{a}"]
+        g.add((ahu, RDF.type, BRICK.AHU))
+        zone_nodes = []
+        for z in range(zones):
+            zone = SYN[f"Zone_{a}_{z}"]
+            g.add((zone, RDF.type, BRICK.Zone))
+            g.add((ahu, BRICK.feeds, zone))
+            sensor = SYN[f"ZN_TEMP_{a}_{z}"]
+            g.add((sensor, RDF.type, BRICK.Zone_Air_Temperature_Sensor))
+            g.add((zone, BRICK.hasPoint, sensor))
+            zone_nodes.append(zone)
+
+        for quantity, sensor_class, part_class in (
+                ("SA_TEMP", BRICK.Supply_Air_Temperature_Sensor, BRICK.Fan),
+                ("MA_TEMP", BRICK.Mixed_Air_Temperature_Sensor, BRICK.Mixed_Damper)):
+            point = SYN[f"{quantity}_{a}"]
+            g.add((point, RDF.type, sensor_class))
+            hidden = rng.random() < unmatched
+            if hidden or rng.random() < 0.5:
+                part = SYN[f"{quantity}_PART_{a}"]
+                g.add((part, RDF.type, part_class))
+                g.add((ahu, BRICK.hasPart, part))
+            if hidden:
+                # only reachable through the part: no implementation matches
+                g.add((part, BRICK.hasPoint, point))
+            else:
+                g.add((ahu, BRICK.hasPoint, point))
+
+        return_air = SYN[f"RA_TEMP_{a}"]
+        g.add((return_air, RDF.type, BRICK.Return_Air_Temperature_Sensor))
+        g.add((ahu, BRICK.hasPoint, return_air))
+        if zone_nodes and rng.random() < 0.5:
+            g.add((return_air, BRICK.feeds, zone_nodes[0]))
+
+        for v in range(vavs):
+            vav = SYN[f"VAV_{a}_{v}"]
+            g.add((vav, RDF.type, BRICK.VAV))
+            g.add((vav, BRICK.isPartOf, ahu))
+            if zone_nodes:
+                g.add((vav, BRICK.feeds, zone_nodes[v % len(zone_nodes)]))
+            if rng.random() < 0.7:
+                point = SYN[f"VAV_SA_TEMP_{a}_{v}"]
+                g.add((point, RDF.type, BRICK.Supply_Air_Temperature_Sensor))
+                g.add((vav, BRICK.hasPoint, point))
+    return g
+
+def generate_data(points: List[str], samples: int, step: float = 60.0, seed: int = 0) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Returns (timestamps, {point: values}): `samples` regular samples per point, a daily
+    cycle plus noise, around 10-30 degrees
+    """
+    rng = np.random.default_rng(seed)
+    timestamps = np.arange(samples) * step
+    cycle = np.sin(timestamps * 2 * np.pi / 86400)
+    values = {point: 20 + 5 * cycle + rng.normal(0, 2, samples) for point in points}
+    return timestamps, values
@@ -0,0 +1,126 @@
+'''
+Compiles the CQ expressions of several applications into one Program, in which every
+distinct subexpression is computed once.
+
+Applications often repeat the same terms (e.g. `sat - DelTsf` or `mat + Epsilon_t` in
+several APAR rules), but every call of an application builds new Calc objects, so
+evaluate() cannot tell that two subtrees compute the same thing. The compiler
+hash-conses the nodes of the expressions: two nodes with the same operation over the
+same operands become one instruction, for all the expressions of the Program.
+
+CQs which are not bound to data are constants (their DefaultCQ value, e.g. Epsilon_t),
+and the pointwise operations over constants are computed once, when compiling:
+
+    program = compile_expressions([rule1(g), rule2(g)], inputs={AHU_Tsa, AHU_Tma})
+    fault1, fault2 = program.run({AHU_Tsa: sat, AHU_Tma: mat})
+
+Classes:
+- Program: a list of instructions computing several expressions at once
+
+Functions:
+- compile_expressions: hash-conses and folds CQ expressions into a Program
+'''
+from typing import Dict, Hashable, Iterable, List, Tuple
+from SeeQ import CQ, Calc, DefaultCQ, OPERATORS, VirtualCQ, Window, _window
+
+# operations whose operands can be swapped, so that `a + b` and `b + a` are shared
+COMMUTATIVE = {'add', 'mul', 'and'}
+# comparisons which are shared with their mirror, e.g. `a > b` and `b < a`
+MIRRORED = {'gt': 'lt', 'ge': 'le'}
+
+
+def _order(slot: Tuple) -> Tuple:
+    # a total order of the slots, to sort the operands of commutative operations
+    kind, x = slot
+    return (kind, x if kind == 'reg' else id(x) if kind == 'input' else repr(x))
+
+
+class Program:
+    """
+    Instructions computed in order, each one being (node, operand slots). A slot is
+    ('input', CQ), ('const', value) or ('reg', index of an instruction). `outputs` holds
+    the slot of each compiled expression.
+    """
+    def __init__(self):
+        self.instructions: List[Tuple[Calc, Tuple]] = []
+        self.outputs: List[Tuple] = []
+        self.inputs = set()
+
+    def __len__(self) -> int:
+        return len(self.instructions)
+
+    def run(self, data: Dict, state: Dict = None) -> List:
+        """
+        Computes the expressions over `data`, which maps the input CQs to their values
+        (as in evaluate). `state` carries the window operations across chunks, as in evaluate
+        """
+        registers = []
+
+        def value(slot):
+            kind, x = slot
+            if kind == 'reg':
+                return registers[x]
+            return data[x] if kind == 'input' else x
+
+        for node, slots in self.instructions:
+            if isinstance(node, Window):
+                registers.append(_window(node, value(slots[0]), [value(slot) for slot in slots[1:]], state))
+            else:
+                registers.append(OPERATORS[node.op](value(slots[0]), value(slots[1])))
+        return [value(slot) for slot in self.outputs]
+
+
+def compile_expressions(expressions: Iterable, inputs: Iterable[CQ] = ()) -> Program:
+    """
+    Compiles CQ expressions into a Program. `inputs` are the CQs which will be given
+    data when the Program runs; the other CQs are folded into constants, as evaluate
+    would compute them (their DefaultCQ implementation, or their .value).
+    """
+    program = Program()
+    program.inputs = set(inputs)
+    # structural key of a node -> its slot
+    slots: Dict[Hashable, Tuple] = {}
+    # id of a node already compiled -> its slot (the same node can appear several times)
+    compiled: Dict[int, Tuple] = {}
+
+    def constant(slot) -> bool:
+        return slot[0] == 'const'
+
+    def emit(key, node, operands: List[Tuple]) -> Tuple:
+        if key not in slots:
+            program.instructions.append((node, tuple(operands)))
+            slots[key] = ('reg', len(program.instructions) - 1)
+        return slots[key]
+
+    def _compile(node) -> Tuple:
+        if id(node) not in compiled:
+            compiled[id(node)] = _compile_node(node)
+        return compiled[id(node)]
+
+    def _compile_node(node) -> Tuple:
+        if isinstance(node, Window):
+            # windows are never folded: their result depends on the previous samples
+            operands = [_compile(node.cq1)] + [_compile(arg) for arg in node.args]
+            return emit(('window', node.op, node.cq2) + tuple(operands), node, operands)
+        if isinstance(node, Calc):
+            operands = [_compile(node.cq1), _compile(node.cq2)]
+            if all(constant(slot) for slot in operands):
+                return ('const', OPERATORS[node.op](operands[0][1], operands[1][1]))
+            op, key = node.op, tuple(operands)
+            if op in COMMUTATIVE:
+                key = tuple(sorted(key, key=_order))
+            elif op in MIRRORED:
+                op, key = MIRRORED[op], key[::-1]
+            return emit((op,) + key, node, operands)
+        if isinstance(node, VirtualCQ):
+            return _compile(node.expression)
+        if isinstance(node, CQ):
+            if node in program.inputs:
+                return ('input', node)
+            defaults = [impl for impl in node.implementation if isinstance(impl, DefaultCQ)]
+            return ('const', defaults[0].value if defaults else node.value)
+        # a number, or None for the missing operand of abs()
+        return ('const', node)
+
+    program.outputs = [_compile(expression) for expression in expressions]
+    return program
@@ -0,0 +1,199 @@
+'''
+Execution of resolved applications over time series, one time chunk at a time.
+
+resolve() binds the CQs of an application to points of the graph; this module feeds
+those points with measurements from a time-series source (see timeseries.py) and
+evaluates the CQ expression of the application (see SeeQ.evaluate) on each chunk:
+
+    def rule1(g, sat=AHU_Tsa, mat=AHU_Tma, eps=Epsilon_t):
+        return mat > sat + eps
+
+    for chunk in stream(g, [rule1], source, start, end, chunk=86400):
+        chunk.results[rule1]   -> {target: array of booleans over chunk.timestamps}
+
+Only one chunk of data is in memory at a time, so the length of the history does not matter.
+
+By default the targets of an application are executed together: the series bound to a
+CQ for all the targets are stacked into a (targets x timestamps) matrix, and the
+expression is evaluated once over the matrices instead of once per target. Targets
+whose CQs resolve to defaults in different ways are evaluated in separate groups.
+
+The expressions of all the applications running on a group of targets are compiled
+together (see compiler.py), so that a subexpression shared by several applications
+is computed once per chunk.
+
+Classes:
+-       Chunk: the results of the applications over one time range
+- TargetGroup: targets evaluated together, with the compiled expressions of their applications
+
+Functions:
+-     points_of: the points used by the bindings of applications
+- group_targets: prepares the columnar evaluation of applications
+-    block_size: the number of targets that columnar evaluates together
+-      columnar: evaluates applications for many targets at once, over stacked series
+-        stream: executes applications over a time-series source, chunk by chunk
+'''
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List
+import numpy as np
+from rdflib import Graph
+from rdflib.term import Node
+from SeeQ import evaluate, get_cqs, resolve_bindings
+from compiler import Program, compile_expressions
+from timeseries import BulkFetcher
+
+BLOCK_CELLS = 1 << 15
+
+
+@dataclass
+class Chunk:
+    """
+    The results of the applications over the time range [start, end):
+    results[fn][target] is the value of the expression of fn for target, at each timestamp
+    """
+    start: float
+    end: float
+    timestamps: np.ndarray
+    results: Dict[Callable, Dict[Node, np.ndarray]]
+
+
+def points_of(bindings: Dict) -> List[str]:
+    """
+    The points (as strings of their URIs) used by {fn: {target: {CQ name: point}}} bindings
+    """
+    return sorted({str(point) for targets in bindings.values() for binding in targets.values()
+                   for point in binding.values() if isinstance(point, Node)})
+
+@dataclass
+class TargetGroup:
+    """
+    Targets on which the same applications run, with the same CQs bound to points:
+    - indexes[CQ] holds the row of the point of the CQ for each target (see group_targets),
+    - program computes the expressions of the applications at once (see compiler.py),
+      sharing their common subexpressions and folding the other CQs into constants.
+    """
+    targets: List[Node]
+    fns: List[Callable]
+    indexes: Dict
+    program: Program
+
+
+def group_targets(expressions: Dict, bindings: Dict, rows: Dict[str, int]) -> List[TargetGroup]:
+    """
+    Prepares the columnar evaluation of applications: `expressions` is {fn: expression},
+    `bindings` is {fn: {target: {CQ name: point}}}, and rows[point] is the row of each
+    point (as a string) in the stacked data.
+
+    Targets are grouped by the applications which run on them and the CQs which are
+    bound to points (the others use their defaults). The groups only depend on the
+    bindings, so they are computed once for all the chunks.
+    A CQ is bound to the same point by all the applications that use it, since
+    resolution picks its implementation independently of the application.
+    """
+    cqs = {fn: get_cqs(fn) for fn in expressions}
+    keys: Dict[tuple, List[Node]] = {}
+    for target in dict.fromkeys(target for fn in expressions for target in bindings[fn]):
+        key = tuple((fn, tuple(sorted(name for name, point in bindings[fn][target].items() if isinstance(point, Node))))
+                    for fn in expressions if target in bindings[fn])
+        keys.setdefault(key, []).append(target)
+
+    groups = []
+    for key, targets in keys.items():
+        inputs = {}
+        for fn, names in key:
+            for name in names:
+                inputs.setdefault(cqs[fn][name], (fn, name))
+        indexes = {cq: np.array([rows[str(bindings[fn][target][name])] for target in targets], dtype=np.intp)
+                   for cq, (fn, name) in inputs.items()}
+        fns = [fn for fn, _ in key]
+        program = compile_expressions([expressions[fn] for fn in fns], inputs)
+        groups.append(TargetGroup(targets, fns, indexes, program))
+    return groups
+
+def block_size(length: int) -> int:
+    """
+    The number of targets evaluated together by columnar, for chunks of `length` samples:
+    about BLOCK_CELLS values per operand, which keeps the intermediate matrices in the
+    CPU cache while amortizing the per-call overhead
+    """
+    return max(1, BLOCK_CELLS // max(1, length))
+
+def columnar(groups: List[TargetGroup], matrix: np.ndarray, states: Dict = None,
+             block: int = None) -> Dict[Callable, Dict[Node, np.ndarray]]:
+    """
+    Evaluates the applications for all their targets at once, over `matrix` (one row
+    per point, see group_targets), and returns {fn: {target: result}}, as evaluate would
+    return for each application and target.
+
+    `states` holds the state of the window operations (see evaluate) for each block of
+    targets, across the chunks of a stream: the same dictionary and the same `block`
+    size must then be given for every chunk.
+    """
+    length = matrix.shape[1]
+    block = block or block_size(length)
+    results = {}
+    for g, group in enumerate(groups):
+        for i in range(0, len(group.targets), block):
+            targets = group.targets[i:i + block]
+            values = {cq: matrix[index[i:i + block]] for cq, index in group.indexes.items()}
+            state = None if states is None else states.setdefault((g, i), {})
+            for fn, result in zip(group.fns, group.program.run(values, state)):
+                if np.ndim(result) < 2:
+                    result = np.broadcast_to(result, (len(targets), length))
+                results.setdefault(fn, {}).update(zip(targets, result))
+    return results
+
+def stream(g: Graph, fns: List[Callable], source, start: float, end: float, chunk: float,
+           bindings: Dict = None, inference: bool = False, engine: str = "sparql",
+           by_target: bool = False) -> Iterator[Chunk]:
+    """
+    Executes the applications `fns` over the measurements of `source` between start and end,
+    in chunks of `chunk` time units, and yields a Chunk per time range.
+
+    The applications are resolved on the graph (see SeeQ.resolve_bindings), unless their
+    `bindings` are given. Each application is called once with its CQs, which builds its
+    expression; the expressions are then evaluated on the data of each chunk, for all the
+    targets at once (see columnar), or application by application and target by target
+    with `by_target=True`.
+
+    The union of the points of all applications is read once per chunk, through a
+    BulkFetcher (pass one as `source` to configure batching and caching).
+
+    The window operations of the expressions (rolling means, persistence, hysteresis...)
+    continue from one chunk to the next, so each chunk only reads its own time range.
+    """
+    if not isinstance(source, BulkFetcher):
+        source = BulkFetcher(source)
+    if bindings is None:
+        bindings = resolve_bindings(g, fns, inference, engine)
+    expressions = {fn: fn(g) for fn in fns}
+    cqs = {fn: get_cqs(fn) for fn in fns}
+    points = points_of({fn: bindings[fn] for fn in fns})
+    if not by_target:
+        # every point is stacked once per chunk, in a row shared by all the applications
+        rows = {point: i for i, point in enumerate(points)}
+        groups = group_targets(expressions, bindings, rows)
+        block = None
+    # the state of the window operations, per block of targets (or per application and target)
+    states = {} if not by_target else {fn: {} for fn in fns}
+
+    lo = start
+    while lo < end:
+        hi = min(lo + chunk, end)
+        timestamps, data = source.read(points, lo, hi)
+        if not by_target:
+            matrix = np.stack([data[point] for point in points]) if points else np.empty((0, len(timestamps)))
+            # the blocks of targets must stay the same from chunk to chunk, for their states
+            block = block or block_size(len(timestamps))
+            results = columnar(groups, matrix, states, block)
+            results = {fn: results.get(fn, {}) for fn in fns}
+        else:
+            results = {}
+            for fn in fns:
+                results[fn] = {}
+                for target, binding in bindings[fn].items():
+                    values = {cqs[fn][name]: data[str(point)] for name, point in binding.items()
+                              if isinstance(point, Node)}
+                    results[fn][target] = evaluate(expressions[fn], values, states[fn].setdefault(target, {}))
+        yield Chunk(lo, hi, timestamps, results)
+        lo = hi
@@ -0,0 +1,291 @@
+'''
+Compact storage of the fault flags produced by the execution of applications (see
+execution.stream), and queries over them.
+
+    store = FaultStore(step=60)
+    for chunk in stream(g, [rule1], source, start, end, chunk=86400):
+        store.append(chunk.timestamps, chunk.results[rule1])
+    store.fault_hours(start, end)      -> {target: hours during which rule1 was true}
+    store.first(target), store.last(target), store.intervals(target)
+    store.save("rule1")                -> rule1.npy, rule1.timestamps.npy, rule1.json
+    store = FaultStore.load("rule1")   -> the flags are memory-mapped, not read
+
+The flags of all the targets share one time axis, and are bit-packed (np.packbits) into
+a (targets x samples / 8) matrix of bytes: 8 samples per byte instead of one Python
+bool, or one byte of a boolean array, per sample. Each chunk is appended as it is
+evaluated; the samples which do not fill a byte yet are kept unpacked until the next
+chunk. Counts are computed on the packed bytes (a popcount per byte), so a query over
+years of 1-minute data does not unpack them. Runs of consecutive faults are decoded on
+demand (intervals), one target at a time.
+
+Every flagged sample counts as `step` time units of fault (e.g. 60 seconds for 1-minute
+data). Results which are not booleans are flagged where they are non-zero (NaN is not
+a fault).
+
+Classes:
+- FaultStore: bit-packed fault flags of many targets over time
+
+Functions:
+-     record: collects the results of stream() into a FaultStore per application
+'''
+import json
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from rdflib.term import Node
+from rdflib.util import from_n3
+
+FORMAT_VERSION = 1
+
+# number of bits set in each byte value
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+# bytes (targets x columns) processed at once by the counts, to bound the memory of the popcount
+_COUNT_CELLS = 1 << 22
+
+
+def _flags(values, length: int) -> np.ndarray:
+    values = np.asarray(values)
+    if values.dtype != bool:
+        values = np.nan_to_num(values.astype(float)) != 0
+    return np.broadcast_to(values, (length,))
+
+
+class FaultStore:
+    """
+    Fault flags of targets over time (see the module docstring). `step` is the duration
+    of a sample, and `hour` the number of time units in an hour (for fault_hours)
+    """
+    def __init__(self, step: float, hour: float = 3600.0):
+        self.step = step
+        self.hour = hour
+        self.targets: List[Node] = []
+        self.rows: Dict[Node, int] = {}
+        self._timestamps = np.empty(0)
+        self._packed = np.zeros((0, 0), dtype=np.uint8)
+        self._tail = np.zeros((0, 0), dtype=bool)
+        self.length = 0
+        self._nbytes = 0
+
+    # storage
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._timestamps[:self.length]
+
+    @property
+    def packed(self) -> np.ndarray:
+        """
+        The packed flags of the samples which fill whole bytes (the others are in the tail)
+        """
+        return self._packed[:, :self._nbytes]
+
+    def _add_targets(self, targets: Iterable[Node]) -> None:
+        new = [target for target in targets if target not in self.rows]
+        if not new:
+            return
+        for target in new:
+            self.rows[target] = len(self.targets)
+            self.targets.append(target)
+        # the new targets had no fault before they appeared
+        self._packed = np.concatenate([self._packed, np.zeros((len(new), self._packed.shape[1]), np.uint8)])
+        self._tail = np.concatenate([self._tail, np.zeros((len(new), self._tail.shape[1]), bool)])
+
+    def _reserve(self, nbytes: int, length: int) -> None:
+        # grow the buffers geometrically, so that appending n chunks costs O(log n) copies
+        if nbytes > self._packed.shape[1] or not self._packed.flags.writeable:
+            packed = np.zeros((len(self.targets), max(nbytes, 2 * self._packed.shape[1])), np.uint8)
+            packed[:, :self._nbytes] = self._packed[:, :self._nbytes]
+            self._packed = packed
+        if length > len(self._timestamps) or not self._timestamps.flags.writeable:
+            timestamps = np.empty(max(length, 2 * len(self._timestamps)))
+            timestamps[:self.length] = self._timestamps[:self.length]
+            self._timestamps = timestamps
+
+    def append(self, timestamps: np.ndarray, results: Dict[Node, np.ndarray]) -> None:
+        """
+        Appends the results of an application over a chunk: {target: flags at each of the
+        timestamps}, e.g. chunk.results[fn]. The timestamps must follow the ones already
+        stored. Targets missing from the results have no fault over the chunk
+        """
+        timestamps = np.asarray(timestamps, dtype=float)
+        if len(timestamps) and self.length and timestamps[0] <= self._timestamps[self.length - 1]:
+            raise ValueError("chunks must be appended in time order")
+        self._add_targets(results)
+        bits = np.zeros((len(self.targets), self._tail.shape[1] + len(timestamps)), bool)
+        bits[:, :self._tail.shape[1]] = self._tail
+        for target, values in results.items():
+            bits[self.rows[target], self._tail.shape[1]:] = _flags(values, len(timestamps))
+
+        whole = bits.shape[1] // 8
+        self._reserve(self._nbytes + whole, self.length + len(timestamps))
+        self._packed[:, self._nbytes:self._nbytes + whole] = np.packbits(bits[:, :whole * 8], axis=1)
+        self._nbytes += whole
+        # copied, so that the matrix of the chunk is not kept alive by the tail
+        self._tail = bits[:, whole * 8:].copy()
+        self._timestamps[self.length:self.length + len(timestamps)] = timestamps
+        self.length += len(timestamps)
+
+    # queries
+
+    def _range(self, start: Optional[float], end: Optional[float]) -> Tuple[int, int]:
+        # the samples of [start, end)
+        timestamps = self.timestamps
+        lo = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+        hi = self.length if end is None else int(np.searchsorted(timestamps, end, side="left"))
+        return lo, max(lo, hi)
+
+    def _bits(self, row: int, lo: int, hi: int) -> np.ndarray:
+        # the unpacked flags of one target over the samples [lo, hi)
+        packed_end = self._nbytes * 8
+        parts = []
+        if lo < packed_end:
+            first, last = lo // 8, (min(hi, packed_end) + 7) // 8
+            bits = np.unpackbits(self._packed[row, first:last])
+            parts.append(bits[lo - first * 8:min(hi, packed_end) - first * 8].astype(bool))
+        if hi > packed_end:
+            parts.append(self._tail[row, max(lo, packed_end) - packed_end:hi - packed_end])
+        return np.concatenate(parts) if parts else np.zeros(0, bool)
+
+    def counts(self, start: float = None, end: float = None) -> Dict[Node, int]:
+        """
+        The number of faulty samples of every target in [start, end)
+        """
+        lo, hi = self._range(start, end)
+        packed_end = self._nbytes * 8
+        counts = np.zeros(len(self.targets), dtype=np.int64)
+        # whole bytes are counted packed, the partial bytes at the edges are unpacked
+        first, last = (lo + 7) // 8, min(hi, packed_end) // 8
+        if first < last:
+            columns = max(1, _COUNT_CELLS // max(1, len(self.targets)))
+            for b in range(first, last, columns):
+                block = self._packed[:, b:min(last, b + columns)]
+                counts += _POPCOUNT[block].sum(axis=1, dtype=np.int64)
+            edges = [(lo, first * 8), (last * 8, min(hi, packed_end))]
+        else:
+            edges = [(lo, min(hi, packed_end))]
+        for a, b in edges:
+            if a < b:
+                bits = np.unpackbits(self._packed[:, a // 8:(b + 7) // 8], axis=1)
+                counts += bits[:, a - a // 8 * 8:b - a // 8 * 8].sum(axis=1, dtype=np.int64)
+        if hi > packed_end:
+            counts += self._tail[:, max(lo, packed_end) - packed_end:hi - packed_end].sum(axis=1)
+        return dict(zip(self.targets, counts.tolist()))
+
+    def fault_hours(self, start: float = None, end: float = None) -> Dict[Node, float]:
+        """
+        The duration of the faults of every target in [start, end), in hours
+        """
+        return {target: count * self.step / self.hour for target, count in self.counts(start, end).items()}
+
+    def _occurrence(self, target: Node, start: Optional[float], end: Optional[float], last: bool) -> Optional[float]:
+        if target not in self.rows:
+            return None
+        lo, hi = self._range(start, end)
+        row = self.rows[target]
+        # look for the first (or last) non-zero byte instead of unpacking the whole range
+        packed_end = self._nbytes * 8
+        spans = [(hi > packed_end, max(lo, packed_end), hi), (lo < packed_end, lo, min(hi, packed_end))]
+        for present, a, b in (spans if last else spans[::-1]):
+            if not present or a >= b:
+                continue
+            if a >= packed_end:
+                found = np.flatnonzero(self._bits(row, a, b))
+                if len(found):
+                    return float(self._timestamps[a + found[-1 if last else 0]])
+                continue
+            first_byte, last_byte = a // 8, (b + 7) // 8
+            nonzero = np.flatnonzero(self._packed[row, first_byte:last_byte])
+            for byte in (nonzero[::-1] if last else nonzero):
+                lo_bit, hi_bit = max(a, (first_byte + byte) * 8), min(b, (first_byte + byte + 1) * 8)
+                found = np.flatnonzero(self._bits(row, lo_bit, hi_bit))
+                if len(found):
+                    return float(self._timestamps[lo_bit + found[-1 if last else 0]])
+        return None
+
+    def first(self, target: Node, start: float = None, end: float = None) -> Optional[float]:
+        """
+        The timestamp of the first fault of the target in [start, end), or None
+        """
+        return self._occurrence(target, start, end, last=False)
+
+    def last(self, target: Node, start: float = None, end: float = None) -> Optional[float]:
+        """
+        The timestamp of the last fault of the target in [start, end), or None
+        """
+        return self._occurrence(target, start, end, last=True)
+
+    def intervals(self, target: Node, start: float = None, end: float = None) -> List[Tuple[float, float]]:
+        """
+        The runs of consecutive faulty samples of the target in [start, end), as
+        (timestamp of the first sample, timestamp of the last sample + step)
+        """
+        if target not in self.rows:
+            return []
+        lo, hi = self._range(start, end)
+        bits = self._bits(self.rows[target], lo, hi).astype(np.int8)
+        edges = np.diff(np.concatenate([[0], bits, [0]]))
+        starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+        timestamps = self._timestamps[lo:hi]
+        return [(float(timestamps[s]), float(timestamps[e - 1]) + self.step) for s, e in zip(starts, ends)]
+
+    def flags(self, target: Node, start: float = None, end: float = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The (timestamps, boolean flags) of the target in [start, end)
+        """
+        lo, hi = self._range(start, end)
+        if target not in self.rows:
+            return self._timestamps[lo:hi], np.zeros(hi - lo, bool)
+        return self._timestamps[lo:hi], self._bits(self.rows[target], lo, hi)
+
+    # persistence
+
+    def save(self, path: str) -> None:
+        """
+        Writes the flags to <path>.npy (the packed matrix, tail included), the timestamps
+        to <path>.timestamps.npy and the targets and parameters to <path>.json
+        """
+        packed = np.zeros((len(self.targets), (self.length + 7) // 8), np.uint8)
+        packed[:, :self._nbytes] = self.packed
+        if self._tail.shape[1]:
+            packed[:, self._nbytes:] = np.packbits(self._tail, axis=1)
+        np.save(f"{path}.npy", packed)
+        np.save(f"{path}.timestamps.npy", self.timestamps)
+        with open(f"{path}.json", "w") as f:
+            json.dump({'version': FORMAT_VERSION, 'length': self.length, 'step': self.step, 'hour': self.hour,
+                       'targets': [target.n3() for target in self.targets]}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "FaultStore":
+        """
+        Opens a store written by save(). With mmap=True the arrays are memory-mapped
+        (read-only): queries only read the pages they need, and the first append copies them
+        """
+        with open(f"{path}.json") as f:
+            meta = json.load(f)
+        if meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"unsupported fault store version {meta.get('version')!r}")
+        store = cls(meta['step'], meta['hour'])
+        store.targets = [from_n3(target) for target in meta['targets']]
+        store.rows = {target: row for row, target in enumerate(store.targets)}
+        mode = "r" if mmap else None
+        packed = np.load(f"{path}.npy", mmap_mode=mode)
+        store._timestamps = np.load(f"{path}.timestamps.npy", mmap_mode=mode)
+        store.length = meta['length']
+        # the last byte is only partly filled: its samples go back to the tail
+        store._nbytes = store.length // 8
+        store._packed = packed
+        tail = store.length - store._nbytes * 8
+        store._tail = np.unpackbits(np.asarray(packed[:, store._nbytes:store._nbytes + 1]), axis=1)[:, :tail].astype(bool) \
+            if tail else np.zeros((len(store.targets), 0), bool)
+        return store
+
+
+def record(chunks: Iterable, fns: List[Callable], step: float, hour: float = 3600.0) -> Dict[Callable, FaultStore]:
+    """
+    Consumes the chunks of execution.stream and returns a FaultStore per application
+    """
+    stores = {fn: FaultStore(step, hour) for fn in fns}
+    for chunk in chunks:
+        for fn, store in stores.items():
+            store.append(chunk.timestamps, chunk.results.get(fn, {}))
+    return stores
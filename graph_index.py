@@ -0,0 +1,395 @@
+'''
+Indexes that are built once over a graph and then reused by the resolution of GraphCQs.
+
+Every clause generated by shape_to_query uses `rdf:type/rdfs:subClassOf*`, which makes
+rdflib walk the class hierarchy of the ontology (Brick.ttl) for every candidate node.
+The indexes below materialize that hierarchy once, so that class membership becomes a
+set lookup. On top of them, match_pattern evaluates the patterns of a GraphCQ directly,
+without going through the SPARQL engine (the "native" engine of resolve).
+
+Classes:
+- ClassHierarchy: transitive rdfs:subClassOf closure of an ontology
+-      TypeIndex: instance -> all of its (inferred) classes, for a building graph
+-     GraphIndex: subject -> predicate -> objects adjacency, plus the TypeIndex
+
+Functions:
+-   graph_version: version of a graph, used to invalidate the indexes
+-      invalidate: changes the version of a graph
+-     graph_cache: per-graph cache which is cleared when the graph version changes
+- graph_fingerprint: content hash of a graph, stable across processes
+- hierarchy_for: the (cached) ClassHierarchy of a graph
+-      types_for: the (cached) TypeIndex of a graph
+-      index_for: the (cached) GraphIndex of a graph
+-    graph_parts: the building and ontology graphs behind a union view
+-    prune_graph: the part of a graph which the patterns of GraphCQs can match
+-    point_order: which point is chosen when a target has several
+-  match_pattern: native evaluation of the patterns of a GraphCQ over a GraphIndex
+'''
+import hashlib
+import threading
+import weakref
+from collections import defaultdict
+from typing import Dict, FrozenSet, Hashable, Iterator, List, Optional, Set, Tuple
+from rdflib import BNode, Graph, RDF, RDFS
+from rdflib.store import TripleAddedEvent
+from rdflib.term import Node
+
+# per-graph state, keyed by id(): rdflib graphs compare (and hash) by identifier, so two
+# graphs with the same identifier would share the entries of a WeakKeyDictionary
+_graph_caches: Dict[int, list] = {}
+_invalidations: Dict[int, int] = {}
+_add_counters: Dict[int, "_AddCounter"] = {}
+# graphs are shared by threads (e.g. by a ResolutionService): caches and indexes are
+# created under this lock, so that each one is built once
+_lock = threading.RLock()
+
+
+def _attached(registry: Dict[int, object], obj, factory):
+    # registry[id(obj)], created by factory() and dropped when obj is garbage collected
+    key = id(obj)
+    if key not in registry:
+        with _lock:
+            if key not in registry:
+                registry[key] = factory()
+                weakref.finalize(obj, registry.pop, key, None)
+    return registry[key]
+
+class _AddCounter:
+    # subscribed to the TripleAddedEvents that rdflib stores dispatch from Store.add
+    def __init__(self, store):
+        self.count = 0
+        dispatcher = getattr(store, 'dispatcher', None)
+        if dispatcher is not None:
+            dispatcher.subscribe(TripleAddedEvent, self)
+
+    def __call__(self, event) -> None:
+        self.count += 1
+
+
+def graph_version(g: Graph) -> Hashable:
+    """
+    Returns the version of a graph, which changes every time triples are added or removed:
+    (number of added triples, number of triples, number of invalidate(g) calls).
+    Additions are counted through the events of the store (rdflib's stores dispatch one
+    from Store.add); removals change the number of triples. For a store that does not
+    dispatch its additions, a change which keeps the number of triples (e.g. replacing a
+    triple) is only seen if the caller calls invalidate(g).
+    For a union view, the versions of the building and the ontology are combined.
+    """
+    building, ontology = graph_parts(g)
+    if building is not g:
+        return graph_version(building), graph_version(ontology)
+    added = _attached(_add_counters, g.store, lambda: _AddCounter(g.store)).count
+    return added, len(g), _invalidations.get(id(g), 0)
+
+def invalidate(g: Graph) -> None:
+    """
+    Changes the version of the graph, e.g. after its store was changed behind its back
+    """
+    with _lock:
+        _attached(_invalidations, g, int)
+        _invalidations[id(g)] += 1
+
+def graph_cache(g: Graph) -> Dict:
+    """
+    Returns a dictionary attached to the graph (by identity), which is emptied every time
+    the version of the graph changes. Indexes and memoized results are stored here, and
+    are dropped together with the graph.
+    """
+    version = graph_version(g)
+    entry = _attached(_graph_caches, g, lambda: [(None, {})])
+    if entry[0][0] != version:
+        with _lock:
+            if entry[0][0] != version:
+                entry[0] = (version, {})
+    return entry[0][1]
+
+def _cached(cache: Dict, name: str, build):
+    # cache[name], built by build() in one thread only
+    if name not in cache:
+        with _lock:
+            if name not in cache:
+                cache[name] = build()
+    return cache[name]
+
+def _bnode_labels(g: Graph) -> Dict[BNode, str]:
+    # blank node ids change every time a file is parsed: a blank node is labelled by a
+    # hash of its predicates and objects instead, nested blank nodes first
+    labels, active = {}, set()
+    for root in g.all_nodes():
+        if not isinstance(root, BNode):
+            continue
+        stack = [(root, False)]
+        while stack:
+            node, described = stack.pop()
+            if node in labels or (not described and node in active):
+                continue
+            if not described:
+                active.add(node)
+                stack.append((node, True))
+                stack.extend((o, False) for o in g.objects(node) if isinstance(o, BNode) and o not in labels)
+                continue
+            active.discard(node)
+            # a blank node in a cycle of blank nodes is described without the nodes of the cycle
+            text = "\n".join(sorted(f"{p.n3()} {labels.get(o, '_:') if isinstance(o, BNode) else o.n3()}"
+                                    for p, o in g.predicate_objects(node)))
+            labels[node] = "_:" + hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    return labels
+
+def _triple_hash(triple, labels: Dict[BNode, str]) -> int:
+    text = " ".join(labels[term] if isinstance(term, BNode) else term.n3() for term in triple)
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=16).digest(), "big")
+
+def graph_fingerprint(g: Graph) -> str:
+    """
+    Returns a hash of the triples of the graph, which does not depend on their order,
+    and is computed once per version of the graph. For a union view (see ontology.py),
+    the fingerprints of the building and the ontology are combined, so that the
+    fingerprint of the shared ontology is only computed once.
+    Blank nodes are hashed by what they describe, not by their ids, so that parsing
+    the same file twice gives the same fingerprint. Two blank nodes with the same
+    description (e.g. two empty nodes) are not told apart.
+    """
+    building, ontology = graph_parts(g)
+    if building is not g:
+        return hashlib.sha256(f"{graph_fingerprint(building)}:{graph_fingerprint(ontology)}".encode()).hexdigest()
+    def fingerprint():
+        labels = _bnode_labels(g)
+        total = 0
+        for triple in g:
+            total = (total + _triple_hash(triple, labels)) % (1 << 128)
+        return f"{total:032x}"
+    return _cached(graph_cache(g), 'fingerprint', fingerprint)
+
+
+class ClassHierarchy:
+    """
+    The transitive closure of rdfs:subClassOf in an ontology. Closures are computed
+    lazily per class and memoized, so asking for the subclasses of brick:AHU walks the
+    hierarchy once.
+
+    hierarchy.subclasses(BRICK.AHU)   -> {brick:AHU, brick:RTU, brick:DOAS, ...}
+    hierarchy.superclasses(BRICK.RTU) -> {brick:RTU, brick:AHU, brick:HVAC_Equipment, ...}
+    """
+    def __init__(self, ontology: Graph):
+        self.children: Dict[Node, Set[Node]] = defaultdict(set)
+        self.parents: Dict[Node, Set[Node]] = defaultdict(set)
+        for sub, sup in ontology.subject_objects(RDFS.subClassOf):
+            self.children[sup].add(sub)
+            self.parents[sub].add(sup)
+        self._subclasses: Dict[Node, FrozenSet[Node]] = {}
+        self._superclasses: Dict[Node, FrozenSet[Node]] = {}
+
+    @staticmethod
+    def _closure(start: Node, edges: Dict[Node, Set[Node]]) -> FrozenSet[Node]:
+        seen = {start}
+        stack = [start]
+        while stack:
+            for nxt in edges.get(stack.pop(), ()):
+                if nxt not in seen:
+                    seen.add(nxt)
+                    stack.append(nxt)
+        return frozenset(seen)
+
+    def subclasses(self, cls: Node) -> FrozenSet[Node]:
+        """
+        All classes c such that `c rdfs:subClassOf* cls` (including cls itself)
+        """
+        if cls not in self._subclasses:
+            self._subclasses[cls] = self._closure(cls, self.children)
+        return self._subclasses[cls]
+
+    def superclasses(self, cls: Node) -> FrozenSet[Node]:
+        """
+        All classes c such that `cls rdfs:subClassOf* c` (including cls itself)
+        """
+        if cls not in self._superclasses:
+            self._superclasses[cls] = self._closure(cls, self.parents)
+        return self._superclasses[cls]
+
+
+class TypeIndex:
+    """
+    Maps every instance of a building graph to all of its classes, i.e. the classes
+    reachable through `rdf:type/rdfs:subClassOf*`.
+    """
+    def __init__(self, g: Graph, hierarchy: ClassHierarchy):
+        self.hierarchy = hierarchy
+        self.types: Dict[Node, Set[Node]] = defaultdict(set)
+        self.by_class: Dict[Node, Set[Node]] = defaultdict(set)
+        for node, cls in g.subject_objects(RDF.type):
+            self.types[node].update(hierarchy.superclasses(cls))
+        for node, types in self.types.items():
+            for cls in types:
+                self.by_class[cls].add(node)
+
+    def is_a(self, node: Node, cls: Node) -> bool:
+        return cls in self.types.get(node, ())
+
+    def retype(self, node: Node, classes) -> None:
+        """
+        Replaces the asserted classes of a node, e.g. after an rdf:type triple was added or removed
+        """
+        for cls in self.types.pop(node, ()):
+            self.by_class[cls].discard(node)
+        types = set()
+        for cls in classes:
+            types.update(self.hierarchy.superclasses(cls))
+        if types:
+            self.types[node] = types
+            for cls in types:
+                self.by_class[cls].add(node)
+
+    def instances(self, cls: Node) -> Set[Node]:
+        return self.by_class.get(cls, set())
+
+
+def graph_parts(g: Graph) -> Tuple[Graph, Graph]:
+    """
+    Returns the (building, ontology) graphs of a union view of a building and a shared
+    ontology (see ontology.py). A plain graph holds both, and is returned twice
+    """
+    return getattr(g.store, 'building', g), getattr(g.store, 'ontology', g)
+
+def prune_graph(g: Graph, patterns, hierarchy: ClassHierarchy = None) -> Graph:
+    """
+    Returns a plain graph with only the triples of `g` that the GraphCQ patterns
+    (SeeQ.ShapePattern) can match:
+    - the triples of the building whose predicate is a path of one of the patterns,
+    - the rdf:type triples of the building whose class is a subclass of a class of the
+      patterns (a target class, or the class of a step),
+    - the rdfs:subClassOf triples between these subclasses, so that
+      `rdf:type/rdfs:subClassOf*` and the ClassHierarchy of the pruned graph still
+      reach the classes of the patterns.
+    Labels, external references, the rest of the ontology etc. are left out. The
+    patterns match the same (target, point) pairs on the pruned graph as on `g`.
+    """
+    hierarchy = hierarchy_for(g) if hierarchy is None else hierarchy
+    building = graph_parts(g)[0]
+    predicates, classes = set(), set()
+    for pattern in patterns:
+        classes.update(pattern.targets)
+        for prop, classname in pattern.steps:
+            predicates.add(prop)
+            classes.add(classname)
+    relevant = set()
+    for cls in classes:
+        relevant |= hierarchy.subclasses(cls)
+
+    pruned = Graph()
+    for prefix, namespace in building.namespaces():
+        pruned.bind(prefix, namespace, override=False)
+    for prop in predicates:
+        for s, o in building.subject_objects(prop):
+            pruned.add((s, prop, o))
+    for s, cls in building.subject_objects(RDF.type):
+        if cls in relevant:
+            pruned.add((s, RDF.type, cls))
+    for sub in relevant:
+        for sup in hierarchy.parents.get(sub, ()):
+            if sup in relevant:
+                pruned.add((sub, RDFS.subClassOf, sup))
+    return pruned
+
+def hierarchy_for(g: Graph) -> ClassHierarchy:
+    """
+    Returns the ClassHierarchy of the graph, which is built once per version of the graph.
+    For a union view of a building and a shared ontology, it is the hierarchy of the
+    ontology, which is built once per process
+    """
+    ontology = graph_parts(g)[1]
+    return _cached(graph_cache(ontology), 'hierarchy', lambda: ClassHierarchy(ontology))
+
+def types_for(g: Graph, hierarchy: ClassHierarchy = None) -> TypeIndex:
+    """
+    Returns the TypeIndex of the graph, which is built once per version of the graph.
+    For a union view, only the instances of the building graph are indexed
+    """
+    return _cached(graph_cache(g), 'types', lambda: TypeIndex(graph_parts(g)[0], hierarchy or hierarchy_for(g)))
+
+class GraphIndex:
+    """
+    An adjacency list of the graph (subject -> predicate -> objects) and its TypeIndex.
+    It is built once per version of the graph and shared by every GraphCQ.
+    """
+    def __init__(self, g: Graph, types: TypeIndex):
+        self.types = types
+        self.adjacency: Dict[Node, Dict[Node, List[Node]]] = defaultdict(lambda: defaultdict(list))
+        for s, p, o in g:
+            self.adjacency[s][p].append(o)
+
+    def objects(self, subject: Node, predicate: Node) -> List[Node]:
+        return self.adjacency.get(subject, {}).get(predicate, [])
+
+    def add(self, triple: Tuple[Node, Node, Node]) -> None:
+        """
+        Updates the index after a triple was added to the graph
+        """
+        s, p, o = triple
+        objects = self.adjacency[s][p]
+        if o not in objects:
+            objects.append(o)
+        if p == RDF.type:
+            self.types.retype(s, objects)
+
+    def remove(self, triple: Tuple[Node, Node, Node]) -> None:
+        """
+        Updates the index after a triple was removed from the graph
+        """
+        s, p, o = triple
+        objects = self.adjacency.get(s, {}).get(p, [])
+        if o in objects:
+            objects.remove(o)
+        if p == RDF.type:
+            self.types.retype(s, objects)
+
+
+def index_for(g: Graph) -> GraphIndex:
+    """
+    Returns the GraphIndex of the graph, which is built once per version of the graph.
+    For a union view, only the triples of the building graph are indexed
+    """
+    return _cached(graph_cache(g), 'index', lambda: GraphIndex(graph_parts(g)[0], types_for(g)))
+
+def point_order(point: Optional[Node]) -> str:
+    """
+    The key of the point chosen when a target matches a pattern with several points:
+    both engines choose the smallest point in N3, so that they resolve alike
+    """
+    return "" if point is None else point.n3()
+
+def match_pattern(index: GraphIndex, pattern, targets: Optional[Iterator[Node]] = None) -> Iterator[Tuple[Node, Optional[Node]]]:
+    """
+    Evaluates the pattern of a GraphCQ (a SeeQ.ShapePattern) and yields one (target, point)
+    pair per target matched by the query generated by shape_to_query. When the target has
+    several points, the first one by point_order is yielded, as GraphCQ.candidates does.
+
+    As in the SHACL shape, every (path, class) step is a property of the target: the
+    target needs at least one object through `path` which is an instance of `class`.
+    The steps listed in pattern.points give the point; its object must satisfy all of them.
+    A pattern without steps yields (target, None), like the unbound ?point of the query.
+
+    `targets` restricts the evaluation to the given nodes.
+    """
+    types = index.types
+    target_classes = pattern.targets
+    steps = [(prop, classname, idx in pattern.points) for idx, (prop, classname) in enumerate(pattern.steps)]
+
+    if targets is None:
+        if target_classes:
+            targets = set().union(*(types.instances(tc) for tc in target_classes))
+        else:
+            targets = list(index.adjacency)
+    for target in targets:
+        if target_classes and not any(types.is_a(target, tc) for tc in target_classes):
+            continue
+        found = None
+        for prop, classname, is_point in steps:
+            matches = [o for o in index.objects(target, prop) if types.is_a(o, classname)]
+            if is_point:
+                found = matches if found is None else [o for o in found if o in matches]
+                matches = found
+            if not matches:
+                break
+        else:
+            yield target, min(found, key=point_order) if found else None
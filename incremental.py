@@ -0,0 +1,204 @@
+'''
+Incremental re-resolution of applications when a building graph changes.
+
+    resolver = IncrementalResolver(g, [rule1, rule2])
+    resolver.bindings[rule1]                       -> {target: {CQ name: point}}
+    diff = resolver.update(added=[(om.AHU_5, BRICK.hasPoint, om.SA_TEMP_5)])
+    diff.added[rule1]                              -> targets which became runnable
+
+An update only re-resolves the GraphCQ implementations whose shapes mention one of the
+changed predicates or (a superclass of) one of the changed classes, and only for the
+targets touched by the change. Changes to rdfs:subClassOf re-resolve everything.
+
+Classes:
+-          BindingDiff: the effect of an update on the bindings of each application
+- IncrementalResolver: keeps the bindings of applications up to date with graph deltas
+'''
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+from rdflib import Graph, RDF, RDFS
+from rdflib.term import Node
+from graph_index import graph_cache, graph_parts, hierarchy_for, index_for, invalidate
+from SeeQ import DefaultCQ, GraphCQ, _bind, get_cqs
+
+Triple = Tuple[Node, Node, Node]
+
+
+@dataclass
+class BindingDiff:
+    """
+    For each application:
+    -   added: {target: binding} of the targets on which the application can now run
+    - removed: {target: binding} of the targets on which it cannot run anymore (old binding)
+    - changed: {target: (old binding, new binding)} where a CQ resolves differently
+    """
+    added: Dict[Callable, Dict] = field(default_factory=dict)
+    removed: Dict[Callable, Dict] = field(default_factory=dict)
+    changed: Dict[Callable, Dict] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return any(self.added.values()) or any(self.removed.values()) or any(self.changed.values())
+
+
+class IncrementalResolver:
+    """
+    Resolves applications on a graph once, and then keeps their bindings (as returned by
+    SeeQ.resolve_bindings) up to date when triples are added to or removed from the graph.
+    The graph can be a union view of a building and a shared ontology (see ontology.py),
+    in which case the changes are applied to the building graph.
+    """
+    def __init__(self, g: Graph, fns: List[Callable], inference: bool = False, engine: str = "sparql"):
+        self.g = g
+        self.fns = fns
+        self.engine = engine
+        # the class hierarchy is used to tell which type changes matter, and by the queries with inference=True
+        self.classes = hierarchy_for(g)
+        self.hierarchy = self.classes if inference else None
+        self.cqs = {fn: get_cqs(fn) for fn in fns}
+
+        # every distinct implementation, with the predicates and classes of its shape
+        self.implementations: Dict[Tuple, GraphCQ] = {}
+        for cqs in self.cqs.values():
+            for cq in cqs.values():
+                for impl in cq.implementation:
+                    if isinstance(impl, GraphCQ):
+                        self.implementations.setdefault(impl.key, impl)
+        self.signatures = {key: self._signature(impl) for key, impl in self.implementations.items()}
+
+        self.candidates = {key: impl.candidates(g, self.hierarchy, engine)
+                           for key, impl in self.implementations.items()}
+        # every distinct CQ, ranked as in CQ.ranked from the candidates of its implementations
+        self.distinct = {cq.key: cq for cqs in self.cqs.values() for cq in cqs.values()}
+        self.ranked = {key: self._rank(cq) for key, cq in self.distinct.items()}
+        self.bindings = {fn: _bind(cqs, self._candidates_of(cqs)) for fn, cqs in self.cqs.items()}
+
+    @staticmethod
+    def _signature(impl: GraphCQ) -> Tuple[Set[Node], Set[Node]]:
+        predicates, classes = set(), set(impl.pattern.targets)
+        for prop, classname in impl.pattern.steps:
+            predicates.add(prop)
+            classes.add(classname)
+        return predicates, classes
+
+    def _rank(self, cq, targets: Set[Node] = None, best: Dict = None) -> Tuple:
+        # (best, default) as returned by CQ.ranked, for all the targets or only the given ones
+        best = {} if best is None else best
+        default = None
+        graphs = []
+        for index, impl in enumerate(cq.implementation):
+            if isinstance(impl, DefaultCQ):
+                default = (index, impl.value)
+                break
+            graphs.append((index, self.candidates[impl.key]))
+        if targets is None:
+            for index, candidates in reversed(graphs):
+                best.update((target, (index, point)) for target, point in candidates.items())
+            return best, default
+        for target in targets:
+            best.pop(target, None)
+            for index, candidates in graphs:
+                if target in candidates:
+                    best[target] = (index, candidates[target])
+                    break
+        return best, default
+
+    def _candidates_of(self, cqs: Dict) -> Dict:
+        # same structure as SeeQ._get_candidates, from the maintained candidates
+        return {name: self.ranked[cq.key] for name, cq in cqs.items()}
+
+    def _affected(self, key: Tuple, changes: List[Triple]) -> Set[Node]:
+        # the nodes which may have become (or stopped being) targets of an implementation
+        predicates, classes = self.signatures[key]
+        targets = set()
+        for s, p, o in changes:
+            if p in predicates:
+                targets.add(s)
+            elif p == RDF.type and classes & self.classes.superclasses(o):
+                # s may be a target, or the value of a target through one of the predicates
+                targets.add(s)
+                targets.update(t for t, ref in self.g.subject_predicates(s) if ref in predicates)
+        return targets
+
+    def _write(self, added: List[Triple], removed: List[Triple]) -> None:
+        building = graph_parts(self.g)[0]
+        for triple in removed:
+            building.remove(triple)
+        for triple in added:
+            building.add(triple)
+        invalidate(building)
+
+    def _apply(self, added: List[Triple], removed: List[Triple]) -> None:
+        # keep the native index of the graph up to date instead of rebuilding it
+        before = graph_cache(self.g) if self.engine == "native" else {}
+        index = index_for(self.g) if self.engine == "native" else None
+        self._write(added, removed)
+        if index is not None:
+            for triple in removed:
+                index.remove(triple)
+            for triple in added:
+                index.add(triple)
+            after = graph_cache(self.g)
+            after['index'], after['types'] = index, index.types
+            if 'hierarchy' in before:
+                after['hierarchy'] = before['hierarchy']
+
+    def update(self, added: Iterable[Triple] = (), removed: Iterable[Triple] = ()) -> BindingDiff:
+        """
+        Applies the added and removed triples to the graph, re-resolves the affected
+        targets, and returns how the bindings of each application changed
+        """
+        added, removed = list(added), list(removed)
+        changes = added + removed
+        if any(p == RDFS.subClassOf for _, p, _ in changes):
+            # the class hierarchy changed: nothing can be reused
+            return self._reset(added, removed)
+
+        self._apply(added, removed)
+
+        touched = set()
+        for key, impl in self.implementations.items():
+            targets = self._affected(key, changes)
+            if not targets:
+                continue
+            touched |= targets
+            fresh = impl.candidates(self.g, self.hierarchy, self.engine, targets)
+            current = self.candidates[key]
+            for target in targets:
+                current.pop(target, None)
+            current.update(fresh)
+        for key, cq in self.distinct.items():
+            self._rank(cq, touched, self.ranked[key][0])
+        return self._rebind(touched)
+
+    def _reset(self, added: List[Triple], removed: List[Triple]) -> BindingDiff:
+        self._write(added, removed)
+        self.classes = hierarchy_for(self.g)
+        if self.hierarchy is not None:
+            self.hierarchy = self.classes
+        touched = set()
+        for key, impl in self.implementations.items():
+            touched.update(self.candidates[key])
+            self.candidates[key] = impl.candidates(self.g, self.hierarchy, self.engine)
+            touched.update(self.candidates[key])
+        self.ranked = {key: self._rank(cq) for key, cq in self.distinct.items()}
+        return self._rebind(touched)
+
+    def _rebind(self, touched: Set[Node]) -> BindingDiff:
+        diff = BindingDiff()
+        for fn, cqs in self.cqs.items():
+            new = _bind(cqs, self._candidates_of(cqs), touched)
+            old = self.bindings[fn]
+            added, removed, changed = {}, {}, {}
+            for target in touched:
+                before, after = old.get(target), new.get(target)
+                if before is None and after is not None:
+                    added[target] = after
+                    old[target] = after
+                elif before is not None and after is None:
+                    removed[target] = before
+                    del old[target]
+                elif before != after:
+                    changed[target] = (before, after)
+                    old[target] = after
+            diff.added[fn], diff.removed[fn], diff.changed[fn] = added, removed, changed
+        return diff
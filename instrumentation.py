@@ -0,0 +1,105 @@
+'''
+Optional instrumentation of resolution: what each CQ implementation costs, and why
+applications cannot run on some targets.
+
+    stats = ResolutionStats()
+    resolve(g, rule1, stats=stats)
+    stats.as_dict()        -> {'implementations': {...}, 'rules': {...}}
+    stats.to_json("stats.json")
+
+For every GraphCQ implementation: the time to generate its query (or to build the index
+of the graph with engine="native"), the time to execute it, the number of result rows
+and the number of candidate targets. With engine="sparql", the implementations of a CQ
+usually run as one UNION query (see CQ.ranked); while statistics are collected they run
+one by one, so that each of them is measured.
+
+For every application: the resolution time, the number of resolved targets, how often
+each implementation of each CQ was chosen, the implementation chosen for each target,
+and the reason why each failed target failed.
+
+A `hook` is called with every record as it is made (e.g. to forward it to a metrics
+system). Without a ResolutionStats, resolution does not measure anything.
+
+Classes:
+- ResolutionStats: collects the statistics of one or more resolutions
+'''
+import json
+import time
+from typing import Callable, Dict, Optional
+
+
+class ResolutionStats:
+    def __init__(self, hook: Optional[Callable[[Dict], None]] = None):
+        self.hook = hook
+        self.implementations: Dict[str, Dict] = {}
+        self.rules: Dict[str, Dict] = {}
+
+    @staticmethod
+    def now() -> float:
+        return time.perf_counter()
+
+    @staticmethod
+    def label(impl) -> str:
+        # GraphCQs are named after their shape, e.g. AHU_hasPoint_Supply_Air_Temperature_Sensor
+        return getattr(impl, 'description', None) or f"default {getattr(impl, 'value', impl)!r}"
+
+    def _emit(self, record: Dict) -> None:
+        if self.hook is not None:
+            self.hook(record)
+
+    def implementation(self, impl, engine: str, generation: float, execution: float,
+                       rows: int, candidates: int, targets: Optional[int] = None) -> None:
+        """
+        Records one evaluation of a GraphCQ implementation (see GraphCQ.candidates).
+        `targets` is the number of targets it was restricted to, if any
+        """
+        entry = self.implementations.setdefault(self.label(impl), {
+            'engine': engine, 'calls': 0, 'generation': 0.0, 'execution': 0.0, 'rows': 0, 'candidates': 0})
+        entry['calls'] += 1
+        entry['generation'] += generation
+        entry['execution'] += execution
+        entry['rows'] += rows
+        entry['candidates'] = candidates
+        self._emit({'event': 'implementation', 'implementation': self.label(impl), 'engine': engine,
+                    'generation': generation, 'execution': execution, 'rows': rows,
+                    'candidates': candidates, 'targets': targets})
+
+    def rule(self, fn: Callable, cqs: Dict, duration: float, bindings: Dict, chosen: Dict,
+             failures: Dict, cached: bool = False) -> None:
+        """
+        Records the resolution of an application: `chosen` is {target: {CQ name: index of
+        the chosen implementation}} and `failures` {target: [names of the unresolved CQs]}
+        (see SeeQ._bind)
+        """
+        usage = {name: {} for name in cqs}
+        for target, indexes in chosen.items():
+            if target not in bindings:
+                continue
+            for name, index in indexes.items():
+                label = f"{index}:{self.label(cqs[name].implementation[index])}"
+                usage[name][label] = usage[name].get(label, 0) + 1
+        entry = {
+            'duration': duration,
+            'cached': cached,
+            'targets': len(bindings),
+            'failed': len(failures),
+            'usage': usage,
+            'chosen': {str(target): indexes for target, indexes in chosen.items() if target in bindings},
+            'failures': {str(target): f"no implementation of {', '.join(sorted(names))} matches"
+                         for target, names in failures.items()},
+        }
+        self.rules[fn.__name__] = entry
+        self._emit(dict(entry, event='rule', rule=fn.__name__))
+
+    def as_dict(self) -> Dict:
+        return {'implementations': self.implementations, 'rules': self.rules}
+
+    def to_json(self, path: str = None, **kwargs) -> str:
+        """
+        Returns the statistics as JSON, and writes them to `path` if given
+        """
+        text = json.dumps(self.as_dict(), **kwargs)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
@@ -0,0 +1,176 @@
+'''
+A shared, read-only ontology (e.g. Brick.ttl) for all the building graphs of a process.
+
+Instead of parsing Brick.ttl into every building graph:
+
+    g = Graph()
+    g.parse("test_model.ttl")
+    g.parse("Brick.ttl")
+
+the ontology is loaded once per process, and each building is queried through a
+read-only union view of the building graph and the ontology:
+
+    g = building_graph("test_model.ttl")      # uses load_ontology("Brick.ttl")
+    resolve(g, rule1)
+
+The first time an ontology is loaded, a snapshot is written next to it: the triples as
+an array of term indexes (<path>.snapshot.npy, memory-mapped when it is loaded), and a
+JSON file with the distinct terms in N3 and the fingerprint of the ontology (see
+graph_index.graph_fingerprint) (<path>.snapshot). Later processes load the snapshot
+instead of parsing the Turtle file. Snapshots only hold data: nothing in them is executed.
+
+Classes:
+- UnionStore: read-only rdflib store over a building graph and an ontology graph
+
+Functions:
+-  load_ontology: loads (once per process) an ontology graph, through its snapshot
+- building_graph: union view of a building graph and a shared ontology
+'''
+import json
+import os
+from typing import Dict, Iterator, Optional, Union
+import numpy as np
+from rdflib import Graph
+from rdflib.store import Store
+from rdflib.util import from_n3
+from graph_index import graph_cache, graph_fingerprint, graph_version
+
+SNAPSHOT_VERSION = 4
+
+_ontologies: Dict[str, Graph] = {}
+
+
+class UnionStore(Store):
+    """
+    A read-only store which unions the triples of a building graph and an ontology graph.
+    A triple found in both graphs is only returned once, and only counted once by len().
+    """
+    context_aware = False
+    formula_aware = False
+    graph_aware = False
+
+    def __init__(self, building: Graph, ontology: Graph):
+        super().__init__()
+        self.building = building
+        self.ontology = ontology
+        self._len = None, 0
+
+    def triples(self, triple_pattern, context=None) -> Iterator:
+        for triple in self.building.triples(triple_pattern):
+            yield triple, iter(())
+        for triple in self.ontology.triples(triple_pattern):
+            if triple not in self.building:
+                yield triple, iter(())
+
+    def __len__(self, context=None) -> int:
+        # the triples shared by both graphs are counted again when either graph changes
+        version = graph_version(self.building), graph_version(self.ontology)
+        if self._len[0] != version:
+            shared = sum(1 for triple in self.building if triple in self.ontology)
+            self._len = version, len(self.building) + len(self.ontology) - shared
+        return self._len[1]
+
+    def add(self, triple, context=None, quoted=False):
+        raise TypeError("the union of a building and its ontology is read-only, add triples to the building graph")
+
+    def addN(self, quads):
+        raise TypeError("the union of a building and its ontology is read-only, add triples to the building graph")
+
+    def remove(self, triple, context=None):
+        raise TypeError("the union of a building and its ontology is read-only, remove triples from the building graph")
+
+    def bind(self, prefix, namespace, override=True):
+        self.building.bind(prefix, namespace, override=override)
+
+    def namespace(self, prefix):
+        return self.building.store.namespace(prefix)
+
+    def prefix(self, namespace):
+        return self.building.store.prefix(namespace)
+
+    def namespaces(self):
+        return self.building.store.namespaces()
+
+
+def _snapshot_path(path: str) -> str:
+    return f"{path}.snapshot"
+
+def _triples_path(path: str) -> str:
+    return f"{path}.snapshot.npy"
+
+def _source_stamp(path: str):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _write_snapshot(g: Graph, path: str) -> None:
+    terms = {}
+    triples = np.array([[terms.setdefault(term, len(terms)) for term in triple] for triple in g],
+                       dtype=np.int32).reshape(-1, 3)
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'source': _source_stamp(path),
+        'triples': len(triples),
+        'terms': [term.n3() for term in terms],
+        'fingerprint': graph_fingerprint(g),
+    }
+    # several processes may write the snapshot at the same time (e.g. a portfolio resolution):
+    # the triples are replaced first, and the terms, which tell whether they are valid, last
+    tmp = f"{_snapshot_path(path)}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        np.save(f, triples, allow_pickle=False)
+    os.replace(tmp, _triples_path(path))
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, _snapshot_path(path))
+
+def _read_snapshot(path: str) -> Optional[Graph]:
+    try:
+        with open(_snapshot_path(path), encoding='utf-8') as f:
+            snapshot = json.load(f)
+        if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('source') != _source_stamp(path):
+            return None
+        triples = np.load(_triples_path(path), mmap_mode='r', allow_pickle=False)
+    except (OSError, ValueError):
+        return None
+    if triples.shape != (snapshot['triples'], 3):
+        return None
+    g = Graph()
+    terms = [from_n3(term) for term in snapshot['terms']]
+    g.store.addN((terms[s], terms[p], terms[o], g) for s, p, o in triples.tolist())
+    graph_cache(g)['fingerprint'] = snapshot['fingerprint']
+    return g
+
+def load_ontology(path: str = "Brick.ttl", format: str = "turtle", snapshot: bool = True) -> Graph:
+    """
+    Returns the ontology graph at `path`. It is loaded once per process (from its
+    snapshot when there is an up-to-date one) and must be treated as read-only,
+    since it is shared by all the buildings.
+    """
+    key = os.path.abspath(path)
+    if key not in _ontologies:
+        g = _read_snapshot(key) if snapshot else None
+        if g is None:
+            g = Graph()
+            g.parse(key, format=format)
+            if snapshot:
+                try:
+                    _write_snapshot(g, key)
+                except OSError:
+                    pass  # e.g. read-only installation: parse again next time
+        _ontologies[key] = g
+    return _ontologies[key]
+
+def building_graph(source: Union[str, Graph], ontology: Union[str, Graph] = "Brick.ttl", format: str = "turtle") -> Graph:
+    """
+    Returns a read-only union view of a building graph (a Graph or a file to parse) and
+    a shared ontology (a Graph or the path given to load_ontology). The view can be passed
+    to is_applicable, resolve, etc. Changes to the building graph are visible through it.
+    """
+    if not isinstance(source, Graph):
+        building = Graph()
+        building.parse(source, format=format)
+    else:
+        building = source
+    if not isinstance(ontology, Graph):
+        ontology = load_ontology(ontology)
+    return Graph(store=UnionStore(building, ontology))
@@ -0,0 +1,57 @@
+'''
+Resolution of the same applications over a portfolio of buildings, in parallel.
+
+rdflib queries are pure Python, so threads do not help: each building is resolved
+in its own worker process. Workers load the shared ontology once (see ontology.py)
+and return plain bindings (see SeeQ.resolve_bindings), which can be pickled, instead
+of functions holding a live graph.
+
+    results = resolve_portfolio(["building1.ttl", "building2.ttl"], [rule1, rule2])
+    results[0]["rules.rule1"]  -> {target: {CQ name: point}} for building1.ttl, if rule1 is
+                                  defined in rules.py
+
+The applications must be picklable, i.e. functions defined at the top level of a module.
+
+Functions:
+- resolve_portfolio: resolves a list of applications over a list of building graphs
+'''
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Optional, Union
+from rdflib import Graph
+from ontology import building_graph, load_ontology
+from resolution_cache import ResolutionCache
+from SeeQ import resolve_bindings
+
+
+def _load_worker(ontology: Optional[str]) -> None:
+    # parse (or load the snapshot of) the ontology once per worker process
+    if ontology is not None:
+        load_ontology(ontology)
+
+def _resolve_building(source: Union[str, Graph], fns: List[Callable], ontology: Optional[str],
+                      inference: bool, engine: str) -> Dict:
+    if ontology is not None:
+        g = building_graph(source, ontology)
+    elif isinstance(source, Graph):
+        g = source
+    else:
+        g = Graph()
+        g.parse(source)
+    bindings = resolve_bindings(g, fns, inference, engine)
+    return {ResolutionCache.rule_name(fn): bindings[fn] for fn in fns}
+
+def resolve_portfolio(sources: List[Union[str, Graph]], fns: List[Callable], ontology: Optional[str] = "Brick.ttl",
+                      max_workers: Optional[int] = None, inference: bool = False, engine: str = "sparql") -> List[Dict]:
+    """
+    Resolves the applications `fns` on every building of `sources` (files to parse, or graphs),
+    distributing the buildings over a pool of `max_workers` processes (default: one per core).
+
+    Returns, in the order of `sources`, {application name: {target: {CQ name: point}}}, where
+    the name of an application is "module.qualified name" (see ResolutionCache.rule_name), so
+    that applications of the same name in different modules are kept apart.
+    With ontology=None, the sources are expected to contain the ontology themselves.
+    """
+    worker = partial(_resolve_building, fns=fns, ontology=ontology, inference=inference, engine=engine)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_load_worker, initargs=(ontology,)) as pool:
+        return list(pool.map(worker, sources))
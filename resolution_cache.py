@@ -0,0 +1,143 @@
+'''
+A persistent cache of resolved bindings, so that a process resolving the same
+applications on an unchanged building model does not run the resolution queries again.
+
+    cache = ResolutionCache("resolution.sqlite")
+    resolve(g, rule1, cache=cache)        # resolves, and stores the bindings
+    resolve(g, rule1, cache=cache)        # (e.g. after a restart) loads the bindings
+
+The bindings of an application are stored per target and CQ, with the index of the
+chosen implementation and the point (or default value). They are keyed by:
+- the fingerprint of the graph (see graph_index.graph_fingerprint),
+- the definition of the CQs of the application (their GraphCQ patterns and DefaultCQ values),
+- the SeeQ version, and the inference and engine options of the resolution.
+Any change of these gives a new key; the entries of old keys can be dropped with prune().
+
+Fingerprinting a graph hashes all of its triples. Give the cache union views of the
+buildings and the shared ontology (see ontology.building_graph): only the building is
+hashed, and the fingerprint of the ontology is read from its snapshot. A plain graph
+into which Brick.ttl was parsed is hashed whole, Brick included, in every new process
+(about 1.7 s for Brick), which can cost more than the resolution the cache saves.
+
+Classes:
+- ResolutionCache: SQLite store of the bindings of applications
+
+Functions:
+- definition: a stable description of the CQs of an application
+'''
+import hashlib
+import sqlite3
+from typing import Callable, Dict, Optional
+from rdflib import Graph
+from rdflib.term import Node
+from rdflib.util import from_n3
+from graph_index import graph_fingerprint
+from SeeQ import DefaultCQ, GraphCQ, __version__, get_cqs
+
+
+def definition(fn: Callable) -> str:
+    """
+    Describes the CQs of an application, and the implementations of each CQ in order
+    """
+    parts = []
+    for name, cq in sorted(get_cqs(fn).items()):
+        implementations = []
+        for impl in cq.implementation:
+            if isinstance(impl, GraphCQ):
+                implementations.append(repr(impl.key))
+            elif isinstance(impl, DefaultCQ):
+                implementations.append(f"default {impl.value!r}")
+            else:
+                implementations.append(repr(impl))
+        parts.append(f"{name}={cq.description}[{', '.join(implementations)}]")
+    return "; ".join(parts)
+
+
+class ResolutionCache:
+    """
+    Bindings of applications ({target: {CQ name: point or default value}}, as returned by
+    SeeQ.resolve_bindings) stored in a SQLite file. Pass it as the `cache` of resolve,
+    resolve_many or resolve_bindings, with graphs made by ontology.building_graph.
+    """
+    def __init__(self, path: str = "resolution.sqlite"):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS resolutions (
+                key TEXT PRIMARY KEY, rule TEXT, graph TEXT);
+            CREATE TABLE IF NOT EXISTS bindings (
+                key TEXT, target TEXT, name TEXT, implementation INTEGER, point TEXT, value REAL,
+                PRIMARY KEY (key, target, name));
+        """)
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def rule_name(fn: Callable) -> str:
+        return f"{fn.__module__}.{fn.__qualname__}"
+
+    def key(self, g: Graph, fn: Callable, inference: bool = False, engine: str = "sparql") -> str:
+        text = "\n".join([__version__, graph_fingerprint(g), self.rule_name(fn), definition(fn),
+                          f"inference={inference}", f"engine={engine}"])
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, g: Graph, fn: Callable, inference: bool = False, engine: str = "sparql") -> Optional[Dict]:
+        """
+        Returns the stored bindings of the application on the graph, or None if there are none
+        """
+        key = self.key(g, fn, inference, engine)
+        if self.connection.execute("SELECT 1 FROM resolutions WHERE key = ?", (key,)).fetchone() is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        bindings = {}
+        for target, name, point, value in self.connection.execute(
+                "SELECT target, name, point, value FROM bindings WHERE key = ?", (key,)):
+            bindings.setdefault(from_n3(target), {})[name] = from_n3(point) if point is not None else value
+        return bindings
+
+    def put(self, g: Graph, fn: Callable, inference: bool, engine: str, bindings: Dict, chosen: Dict = None) -> None:
+        """
+        Stores the bindings of the application on the graph. `chosen` holds the index of
+        the implementation chosen for each target and CQ (see SeeQ._bind)
+        """
+        chosen = chosen or {}
+        key = self.key(g, fn, inference, engine)
+        rows = []
+        for target, binding in bindings.items():
+            for name, point in binding.items():
+                rows.append((key, target.n3(), name, chosen.get(target, {}).get(name),
+                             point.n3() if isinstance(point, Node) else None,
+                             None if isinstance(point, Node) else point))
+        with self.connection:
+            self.connection.execute("DELETE FROM bindings WHERE key = ?", (key,))
+            self.connection.executemany("INSERT INTO bindings VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.connection.execute("INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?)",
+                                    (key, self.rule_name(fn), graph_fingerprint(g)))
+
+    def implementations(self, g: Graph, fn: Callable, inference: bool = False, engine: str = "sparql") -> Dict:
+        """
+        Returns {target: {CQ name: index of the chosen implementation}} for stored bindings
+        """
+        key = self.key(g, fn, inference, engine)
+        chosen = {}
+        for target, name, implementation in self.connection.execute(
+                "SELECT target, name, implementation FROM bindings WHERE key = ?", (key,)):
+            chosen.setdefault(from_n3(target), {})[name] = implementation
+        return chosen
+
+    def prune(self, *graphs: Graph) -> int:
+        """
+        Drops the bindings stored for any other graph than `graphs` (e.g. older versions
+        of the building models), and returns the number of dropped resolutions
+        """
+        fingerprints = [graph_fingerprint(g) for g in graphs]
+        placeholders = ", ".join("?" for _ in fingerprints)
+        with self.connection:
+            self.connection.execute(
+                f"DELETE FROM bindings WHERE key IN (SELECT key FROM resolutions WHERE graph NOT IN ({placeholders}))",
+                fingerprints)
+            return self.connection.execute(
+                f"DELETE FROM resolutions WHERE graph NOT IN ({placeholders})", fingerprints).rowcount
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,122 @@
+'''
+An asyncio front-end to applicability checks and resolution, for services answering
+"which rules can run on this building, and where" (e.g. behind a web app).
+
+    service = ResolutionService(max_workers=4, cache_size=256)
+    await service.is_applicable(g, rule1)            -> True
+    await service.resolve(g, rule1)                  -> {target: {CQ name: point}}
+
+The graph work is CPU-bound and blocking: it runs in a bounded thread pool, so that
+the event loop keeps serving other requests. Requests are keyed by the graph, its
+version (see graph_index.graph_version), the rule and the options of the request:
+- a request identical to one which is still running waits for the running one instead
+  of starting the same work again (coalescing),
+- finished results are kept in an LRU cache of `cache_size` entries, shared by all the
+  callers. A new version of the graph gives new keys; the entries of the older versions
+  are evicted as the cache fills up, and all the entries of a graph are dropped once
+  the graph is garbage collected (by the next request, on the event loop).
+
+The indexes and the class hierarchy that the workers share are built once, under the lock
+of graph_index. Results are shared between callers and must not be modified. Failed requests are not
+cached: the error is raised to every caller waiting for it.
+
+Classes:
+- ResolutionService: bounded, coalescing and cached async is_applicable / resolve
+'''
+import asyncio
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Hashable, Tuple
+from rdflib import Graph
+from graph_index import graph_version
+from SeeQ import is_applicable, resolve_bindings
+
+
+def _collected(service: weakref.ref, graph_id: int) -> None:
+    # the finalizer of a graph used by a service
+    service = service()
+    if service is not None:
+        service._collected.append(graph_id)
+
+
+class ResolutionService:
+    """
+    Runs is_applicable and resolve_bindings for asyncio callers (see the module docstring).
+    `executor` replaces the default pool of `max_workers` threads, and is not shut down
+    by close()
+    """
+    def __init__(self, max_workers: int = 4, cache_size: int = 256, executor: Executor = None):
+        self.cache_size = cache_size
+        self.cache: OrderedDict = OrderedDict()
+        self.inflight: Dict[Tuple, asyncio.Future] = {}
+        self._own_executor = executor is None
+        self.executor = ThreadPoolExecutor(max_workers) if executor is None else executor
+        self._graphs = set()
+        # ids of the graphs which were garbage collected, and whose results are still cached
+        self._collected = []
+        self.hits = self.misses = self.coalesced = 0
+
+    def _key(self, g: Graph, *request: Hashable) -> Tuple:
+        # before the id of a collected graph can be given to a new graph, it is in _collected
+        self._forget()
+        if id(g) not in self._graphs:
+            # drop the results of a graph together with the graph. The finalizer can run in
+            # any thread and does not keep the service alive: it only records the graph
+            self._graphs.add(id(g))
+            weakref.finalize(g, _collected, weakref.ref(self), id(g))
+        return (id(g), graph_version(g)) + request
+
+    def _forget(self) -> None:
+        # on the event loop: drops the results of the collected graphs
+        while self._collected:
+            graph_id = self._collected.pop()
+            self._graphs.discard(graph_id)
+            for key in [key for key in self.cache if key[0] == graph_id]:
+                del self.cache[key]
+
+    async def _run(self, key: Tuple, fn: Callable):
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        if key in self.inflight:
+            self.coalesced += 1
+            # shielded: a cancelled caller does not cancel the work the others wait for
+            return await asyncio.shield(self.inflight[key])
+
+        self.misses += 1
+        future = asyncio.get_running_loop().run_in_executor(self.executor, fn)
+        self.inflight[key] = future
+        try:
+            result = await asyncio.shield(future)
+        finally:
+            del self.inflight[key]
+        self.cache[key] = result
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    async def is_applicable(self, g: Graph, fn: Callable, strict: bool = False, engine: str = "sparql") -> bool:
+        """
+        Same as SeeQ.is_applicable
+        """
+        key = self._key(g, 'is_applicable', fn, strict, engine)
+        return await self._run(key, partial(is_applicable, g, fn, strict, engine))
+
+    async def resolve(self, g: Graph, fn: Callable, inference: bool = False, engine: str = "sparql") -> Dict:
+        """
+        Resolves the application on the graph, and returns its bindings:
+        {target: {CQ name: resolved point or default value}} (see SeeQ.resolve_bindings).
+        Unlike the partials of SeeQ.resolve, the bindings do not hold the graph
+        """
+        key = self._key(g, 'resolve', fn, inference, engine)
+        return await self._run(key, lambda: resolve_bindings(g, [fn], inference, engine)[fn])
+
+    def clear(self) -> None:
+        self.cache.clear()
+
+    def close(self) -> None:
+        if self._own_executor:
+            self.executor.shutdown(wait=True)
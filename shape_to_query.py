@@ -1,10 +1,10 @@
-import random
 from collections import defaultdict
-import string
+import threading
+from functools import lru_cache
 from rdflib import Graph, URIRef, Namespace
 from rdflib.paths import ZeroOrMore, ZeroOrOne
 from rdflib.term import Node
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Callable, Optional
 
 BRICK = Namespace("https://brickschema.org/schema/Brick#")
 APAR = Namespace("http://openmetrics.eu/openmetrics/apar#")
@@ -16,7 +16,9 @@ UNIT = Namespace("http://qudt.org/vocab/unit#")
 QUDT = Namespace("https://qudt.org/2.1/schema/datatype")
 A = RDF.type
 
-def shape_to_query(graph: Graph, shape: URIRef) -> str:
+_prepare_lock = threading.Lock()
+
+def shape_to_query(graph: Graph, shape: URIRef, hierarchy=None, ask: bool = False) -> str:
         """
         This method takes a URI representing a SHACL shape as an argument and returns
         a SPARQL query selecting the information which would be used to satisfy that
@@ -24,22 +26,79 @@ def shape_to_query(graph: Graph, shape: URIRef) -> str:
         - `<shape> sh:targetClass <class>` -> `?target rdf:type/rdfs:subClassOf* <class>`
         - `<shape> sh:property [ sh:path <path>; sh:class <class>; sh:name <name> ]` ->
             ?target <path> ?name . ?name rdf:type/rdfs:subClassOf* <class>
+
+        If a ClassHierarchy (see graph_index.py) is given, the property path is replaced
+        by the precomputed subclasses of <class>:
+        - for ?target: `{ ?target rdf:type <class> } UNION { ?target rdf:type <subclass1> } ...`
+        - otherwise: `?name rdf:type ?c . FILTER(?c IN (<class>, <subclass1>, ...))`
+        rdflib evaluates the UNION with one index lookup per class and then joins the
+        rest of the group lazily per target, instead of walking the class hierarchy.
+
+        With ask=True, an ASK query is generated instead, which only checks whether the
+        shape has at least one match and stops at the first one.
         """
-        clauses, project = _shape_to_where(graph, shape)
+        clauses, project = _shape_to_where(graph, shape, hierarchy=hierarchy)
         preamble = """PREFIX sh: <http://www.w3.org/ns/shacl#>
 PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
 PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
         """
-        return f"{preamble} SELECT {' '.join(project)} WHERE {{\n{clauses}\n}}"
+        if ask:
+            return f"{preamble} ASK WHERE {{\n{clauses}\n}}"
+        return f"{preamble} SELECT {' '.join(sorted(project))} WHERE {{\n{clauses}\n}}"
 
-def _shape_to_where(graph: Graph, shape: URIRef) -> Tuple[str, List[str]]:
-    # we will build the query as a string
-    clauses: str = ""
-    # build up the SELECT clause as a set of vars
-    project: Set[str] = {"?target"}
+def pattern_to_query(targets: Tuple[Node, ...], steps: Tuple[Tuple[Node, Node], ...], points: Tuple[int, ...],
+                     hierarchy=None, ask: bool = False) -> str:
+    """
+    Same as shape_to_query, for the shape of a GraphCQ pattern (see SeeQ.ShapePattern)
+    given directly as its target classes, its (path, class) steps and the indexes of the
+    steps which give the point. This generates the query that shape_to_query generates
+    for the SHACL shape of the pattern, without building the shape graph.
+    """
+    clauses, project = pattern_to_where(targets, steps, points, hierarchy)
+    preamble = """PREFIX sh: <http://www.w3.org/ns/shacl#>
+PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+        """
+    if ask:
+        return f"{preamble} ASK WHERE {{\n{clauses}\n}}"
+    return f"{preamble} SELECT {' '.join(sorted(project))} WHERE {{\n{clauses}\n}}"
+
+def union_query(branches: List[Tuple[int, str]]) -> str:
+    """
+    Generates one query for several shapes, e.g. the GraphCQ implementations of a CQ:
+    a UNION of the WHERE clauses of the shapes (see pattern_to_where), in which each
+    branch binds ?impl to the rank given with its clauses:
+
+        SELECT ?impl ?point ?target WHERE {
+            { <clauses of the first shape> BIND(0 AS ?impl) }
+            UNION
+            { <clauses of the second shape> BIND(1 AS ?impl) } ...
+        }
+
+    Variables are local to their branch, so the shapes do not interfere with each other.
+    """
+    union = " UNION ".join(f"{{\n{clauses}BIND({rank} AS ?impl)\n}}" for rank, clauses in branches)
+    preamble = """PREFIX sh: <http://www.w3.org/ns/shacl#>
+PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+        """
+    return f"{preamble} SELECT ?impl ?point ?target WHERE {{\n{union}\n}}"
+
+@lru_cache(maxsize=512)
+def compile_query(query: str) -> "Query":
+    """
+    Parses and algebra-translates a SPARQL query once. Because shape_to_query
+    generates the same text for the same shape, the query text is a canonical key
+    and identical shapes share one prepared query.
+    """
+    # the SPARQL engine (and its parser) is only imported when a query is first prepared
+    from rdflib.plugins.sparql import prepareQuery
+    # the parser (pyparsing) is not thread-safe: queries are prepared one at a time
+    with _prepare_lock:
+        return prepareQuery(query)
 
-    # local state for generating unique variable names
-    prefix = "".join(random.choice(string.ascii_lowercase) for _ in range(2))
+def _make_gensym(prefix: str = "v") -> Callable[[], str]:
+    # deterministic variable names: the same shape always yields the same query text
     variable_counter = 0
 
     def gensym():
@@ -47,11 +106,51 @@ def _shape_to_where(graph: Graph, shape: URIRef) -> Tuple[str, List[str]]:
         varname = f"{prefix}{variable_counter}"
         variable_counter += 1
         return varname
+    return gensym
+
+def _class_clause(var: str, cls: Node, hierarchy, gensym: Callable[[], str], filters: List[str]) -> str:
+    # `var rdf:type/rdfs:subClassOf* cls`, or a lookup in the precomputed subclasses of cls.
+    # FILTERs are added to `filters`, to be placed at the end of the group
+    if hierarchy is None:
+        return f"{var} rdf:type/rdfs:subClassOf* {cls.n3()} .\n"
+    classes = sorted(c.n3() for c in hierarchy.subclasses(cls))
+    if var == "?target":
+        return "{ " + " UNION ".join(f"{{ {var} rdf:type {c} }}" for c in classes) + " }\n"
+    classvar = f"?{gensym()}"
+    filters.append(f"FILTER({classvar} IN ({', '.join(classes)}))\n")
+    return f"{var} rdf:type {classvar} .\n"
+
+def pattern_to_where(targets: Tuple[Node, ...], steps: Tuple[Tuple[Node, Node], ...], points: Tuple[int, ...],
+                     hierarchy=None) -> Tuple[str, List[str]]:
+    # the clauses that _shape_to_where generates for the shape of a pattern: one
+    # targetClass, and one qualified property shape (min count 1) per step
+    gensym = _make_gensym()
+    filters: List[str] = []
+    clauses = " UNION ".join(_class_clause("?target", tc, hierarchy, gensym, filters) for tc in targets)
+    project = {"?target"}
+    for idx, (path, pclass) in enumerate(steps):
+        name = "?point" if idx in points else f"?{gensym()}"
+        clauses += f"?target {path.n3()} {name} .\n " + _class_clause(name, pclass, hierarchy, gensym, filters)
+        project.add(name)
+    clauses += "".join(filters)
+    return clauses, list(project)
+
+def _shape_to_where(graph: Graph, shape: URIRef, gensym: Optional[Callable[[], str]] = None, hierarchy=None) -> Tuple[str, List[str]]:
+    # we will build the query as a string
+    clauses: str = ""
+    # build up the SELECT clause as a set of vars
+    project: Set[str] = {"?target"}
+
+    # local state for generating unique variable names. Nested shapes share the
+    # counter of their parent so that variables never collide
+    if gensym is None:
+        gensym = _make_gensym()
+    filters: List[str] = []
 
     # `<shape> sh:targetClass <class>` -> `?target rdf:type/rdfs:subClassOf* <class>`
     targetClasses = graph.objects(shape, SH.targetClass | SH["class"])
     tc_clauses = [
-        f"?target rdf:type/rdfs:subClassOf* {tc.n3()} .\n" for tc in targetClasses  # type: ignore
+        _class_clause("?target", tc, hierarchy, gensym, filters) for tc in targetClasses  # type: ignore
     ]
     clauses += " UNION ".join(tc_clauses)
 
@@ -64,7 +163,7 @@ def _shape_to_where(graph: Graph, shape: URIRef) -> Tuple[str, List[str]]:
             pshapes_by_path[path].append(pshape)  # type: ignore
 
     for dep_shape in graph.objects(shape, SH.node):
-        dep_clause, dep_project = _shape_to_where(graph, dep_shape)
+        dep_clause, dep_project = _shape_to_where(graph, dep_shape, gensym, hierarchy)
         clauses += dep_clause
         project.update(dep_project)
 
@@ -72,7 +171,7 @@ def _shape_to_where(graph: Graph, shape: URIRef) -> Tuple[str, List[str]]:
         items = list(graph.objects(or_clause, (RDF.rest * ZeroOrMore) / RDF.first))  # type: ignore
         or_parts = []
         for item in items:
-            or_body, or_project = _shape_to_where(graph, item)
+            or_body, or_project = _shape_to_where(graph, item, gensym, hierarchy)
             or_parts.append(or_body)
             project.update(or_project)
         clauses += " UNION ".join(f"{{ {or_body} }}" for or_body in or_parts)
@@ -98,9 +197,12 @@ def _shape_to_where(graph: Graph, shape: URIRef) -> Tuple[str, List[str]]:
             pshape, (SH["qualifiedValueShape"] * ZeroOrOne / SH["class"])  # type: ignore
         )
         if pclass:
-            clause = f"?target {path.n3()} {name} .\n {name} rdf:type/rdfs:subClassOf* {pclass.n3()} .\n"
+            pfilters: List[str] = []
+            clause = f"?target {path.n3()} {name} .\n " + _class_clause(name, pclass, hierarchy, gensym, pfilters)
             if qMinCount == 0:
-                clause = f"OPTIONAL {{ {clause} }} .\n"
+                clause = f"OPTIONAL {{ {clause}{''.join(pfilters)} }} .\n"
+            else:
+                filters.extend(pfilters)
             clauses += clause
             project.add(name)
 
@@ -108,7 +210,7 @@ def _shape_to_where(graph: Graph, shape: URIRef) -> Tuple[str, List[str]]:
             pshape, (SH["qualifiedValueShape"] * ZeroOrOne / SH["node"])  # type: ignore
         )
         if pnode:
-            node_clauses, node_project = _shape_to_where(graph, pnode)
+            node_clauses, node_project = _shape_to_where(graph, pnode, gensym, hierarchy)
             clause = f"?target {path.n3()} {name} .\n"
             clause += node_clauses.replace("?target", name)
             if qMinCount == 0:
@@ -120,4 +222,5 @@ def _shape_to_where(graph: Graph, shape: URIRef) -> Tuple[str, List[str]]:
         if pvalue:
             clauses += f"?target {path.n3()} {pvalue.n3()} .\n"
 
+    clauses += "".join(filters)
     return clauses, list(project)
@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+from rdflib import Graph
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+
+@pytest.fixture(scope="session")
+def brick() -> Graph:
+    from ontology import load_ontology
+    # parsed once for the session, without writing a snapshot next to Brick.ttl
+    return load_ontology(os.path.join(ROOT, "Brick.ttl"), snapshot=False)
+
+@pytest.fixture
+def test_model() -> Graph:
+    g = Graph()
+    g.parse(os.path.join(ROOT, "test_model.ttl"))
+    return g
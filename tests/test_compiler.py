@@ -0,0 +1,33 @@
+import numpy as np
+from CQ_Specification import AHU_Tma, AHU_Tsa, Epsilon_t
+from compiler import compile_expressions
+from SeeQ import evaluate, get_cqs
+
+
+def rule1(g, sat=AHU_Tsa, mat=AHU_Tma, eps=Epsilon_t):
+    return mat > sat + eps
+
+def rule2(g, sat=AHU_Tsa, mat=AHU_Tma, eps=Epsilon_t):
+    # the same comparison, mirrored, over the same sum with its operands swapped
+    return (eps + sat < mat) & (sat > (eps * 2 - 1))
+
+
+def test_shared_subexpressions_are_computed_once():
+    expressions = [rule1(None), rule2(None)]
+    cqs = get_cqs(rule1)
+    program = compile_expressions(expressions, inputs=[cqs['sat'], cqs['mat']])
+    # sat + eps, the comparison with mat, sat > constant and the conjunction
+    assert len(program) == 4
+    assert program.inputs == {cqs['sat'], cqs['mat']}
+    rng = np.random.default_rng(0)
+    data = {cqs['sat']: rng.random(50) * 10, cqs['mat']: rng.random(50) * 10}
+    data[cqs['sat']][3] = np.nan
+    for result, expression in zip(program.run(data), expressions):
+        assert np.array_equal(result, evaluate(expression, data))
+
+def test_constants_are_folded():
+    cqs = get_cqs(rule1)
+    program = compile_expressions([cqs['eps'] * 2 - 1, cqs['sat'] > cqs['eps'] * 2 - 1], inputs=[cqs['sat']])
+    assert len(program) == 1
+    constant, fault = program.run({cqs['sat']: np.array([1.0, 5.0])})
+    assert constant == evaluate(cqs['eps'] * 2 - 1, {}) and fault.tolist() == [False, True]
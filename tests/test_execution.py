@@ -0,0 +1,64 @@
+from functools import partial
+import numpy as np
+import pytest
+from CQ_Specification import AHU_Tma, AHU_Tsa, Epsilon_t, VAV_Tsa
+from execution import points_of, stream
+from ontology import building_graph
+from SeeQ import execute, resolve_bindings
+from synthetic import generate_model
+from timeseries import ArraySource
+
+
+def rule1(g, sat=AHU_Tsa, mat=AHU_Tma, eps=Epsilon_t):
+    return mat > sat + eps
+
+def rule2(g, tsa=VAV_Tsa):
+    return abs(tsa - 20) / 2
+
+
+@pytest.fixture(scope="module")
+def measured(brick):
+    g = building_graph(generate_model(4, 2, 2, seed=0), brick)
+    bindings = resolve_bindings(g, [rule1, rule2], inference=True)
+    rng = np.random.default_rng(0)
+    timestamps = np.arange(1000) * 60.0
+    values = {point: rng.random(len(timestamps)) * 30 for point in points_of(bindings)}
+    values[points_of(bindings)[0]][::7] = np.nan
+    return g, bindings, ArraySource(timestamps, values)
+
+def whole(chunks) -> dict:
+    chunks = list(chunks)
+    return {fn: {target: np.concatenate([chunk.results[fn][target] for chunk in chunks])
+                 for target in chunks[0].results[fn]} for fn in chunks[0].results}
+
+
+def test_chunks_match_the_whole_series(measured):
+    g, bindings, source = measured
+    end = source.timestamps[-1] + 60
+    chunks = list(stream(g, [rule1, rule2], source, 0, end, chunk=60 * 37, bindings=bindings, by_target=True))
+    assert len(chunks) == 28 and sum(len(chunk.timestamps) for chunk in chunks) == 1000
+    results = whole(chunks)
+    assert bindings[rule1] and bindings[rule2]
+    assert set(results[rule1]) == set(bindings[rule1]) and set(results[rule2]) == set(bindings[rule2])
+    for fn in (rule1, rule2):
+        for target, binding in bindings[fn].items():
+            # the same as executing the resolved application over the whole history
+            expected = execute(partial(fn, g, **binding), source.values)
+            assert np.array_equal(results[fn][target], expected, equal_nan=True)
+    # resolved on the fly, in one chunk
+    once = whole(stream(g, [rule1, rule2], source, 0, end, chunk=end, inference=True, by_target=True))
+    for fn in (rule1, rule2):
+        for target in bindings[fn]:
+            assert np.array_equal(results[fn][target], once[fn][target], equal_nan=True)
+
+@pytest.mark.parametrize("chunk", [60 * 37, 60 * 1000])
+def test_columnar_matches_by_target(measured, chunk):
+    g, bindings, source = measured
+    end = source.timestamps[-1] + 60
+    columnar = whole(stream(g, [rule1, rule2], source, 0, end, chunk=chunk, bindings=bindings))
+    by_target = whole(stream(g, [rule1, rule2], source, 0, end, chunk=chunk, bindings=bindings, by_target=True))
+    for fn in (rule1, rule2):
+        assert set(columnar[fn]) == set(by_target[fn])
+        for target, result in by_target[fn].items():
+            assert columnar[fn][target].shape == result.shape
+            assert np.array_equal(columnar[fn][target], result, equal_nan=True)
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+import pytest
+from CQ_Specification import AHU_Tma, AHU_Tsa, Epsilon_t
+from ontology import building_graph
+from SeeQ import Calc, evaluate, execute, get_cqs, resolve
+
+
+def rule1(g, sat=AHU_Tsa, mat=AHU_Tma, eps=Epsilon_t):
+    return mat > sat + eps
+
+
+def test_expressions_are_lazy_and_vectorized():
+    expression = rule1(None)
+    assert isinstance(expression, Calc)
+    cqs = get_cqs(rule1)
+    mat, sat = np.array([10.0, 3.0, np.nan]), np.array([1.0, 2.0, 1.0])
+    assert evaluate(expression, {cqs['mat']: mat, cqs['sat']: sat}).tolist() == [True, False, False]
+    series = evaluate(expression, {cqs['mat']: pd.Series(mat, index=[5, 6, 7]), cqs['sat']: pd.Series(sat, index=[5, 6, 7])})
+    assert list(series.index) == [5, 6, 7] and series.tolist() == [True, False, False]
+    # CQs without data: the DefaultCQ of Epsilon_t, and the scalar values of the others
+    assert evaluate(cqs['mat'] - cqs['eps'], {cqs['mat']: 3.0}) == pytest.approx(3.0 - 2.33)
+    assert evaluate(abs(cqs['mat'] - 5), {cqs['mat']: mat[:2]}).tolist() == [5.0, 2.0]
+
+def test_execute_looks_up_uri_strings(brick, test_model):
+    fn = resolve(building_graph(test_model, brick), rule1, inference=True)[0]
+    sat, mat = str(fn.keywords['sat']), str(fn.keywords['mat'])
+    data = pd.DataFrame({sat: [1.0, 5.0], mat: [300.0, 5.0]})
+    assert execute(fn, data).tolist() == [True, False]
+    assert execute(fn, {fn.keywords['sat']: np.array([1.0]), fn.keywords['mat']: np.array([300.0])}).tolist() == [True]
+    with pytest.raises(KeyError):
+        execute(fn, data[[sat]])
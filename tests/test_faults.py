@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from rdflib import URIRef
+from faults import FaultStore
+
+STEP = 60
+TARGETS = [URIRef(f"urn:t{i}") for i in range(7)]
+RANGES = [(None, None), (0, 1e9), (120, 600), (61, 3000), (333, 334), (60 * 50, 60 * 120), (60 * 7, 60 * 9)]
+
+
+def fill(store: FaultStore, rng, chunk_sizes=(5, 13, 8, 0, 1, 29, 3, 64, 7)):
+    """
+    Appends random flags in chunks of uneven sizes, and returns (timestamps, dense flags per target)
+    """
+    reference = {target: [] for target in TARGETS}
+    stamps_all = []
+    t0 = 0
+    for n in chunk_sizes:
+        stamps = t0 + STEP * np.arange(n)
+        t0 += STEP * n
+        results = {}
+        for i, target in enumerate(TARGETS):
+            if i == 6 and t0 < 500:
+                continue  # a target which appears later, with no fault before
+            flags = rng.random(n) < 0.3
+            results[target] = flags.astype(float) if i == 2 else flags
+        if n == 13:
+            results[TARGETS[1]] = np.full(n, np.nan)
+        store.append(stamps, results)
+        stamps_all.extend(stamps)
+        for target in TARGETS:
+            values = np.asarray(results.get(target, np.zeros(n)), dtype=float)
+            reference[target].extend(np.nan_to_num(values) != 0)
+    return np.array(stamps_all, dtype=float), {target: np.array(flags, bool) for target, flags in reference.items()}
+
+def check(store: FaultStore, timestamps, reference):
+    for lo, hi in RANGES:
+        mask = np.ones(len(timestamps), bool)
+        if lo is not None:
+            mask &= timestamps >= lo
+        if hi is not None:
+            mask &= timestamps < hi
+        counts = store.counts(lo, hi)
+        for target in TARGETS:
+            expected = reference[target][mask]
+            assert counts[target] == expected.sum()
+            found = np.flatnonzero(expected)
+            stamps = timestamps[mask]
+            assert store.first(target, lo, hi) == (stamps[found[0]] if len(found) else None)
+            assert store.last(target, lo, hi) == (stamps[found[-1]] if len(found) else None)
+            assert np.array_equal(store.flags(target, lo, hi)[1], expected)
+            assert sum((end - start) / STEP for start, end in store.intervals(target, lo, hi)) == expected.sum()
+    assert store.fault_hours()[TARGETS[0]] == pytest.approx(reference[TARGETS[0]].sum() * STEP / 3600)
+
+
+def test_matches_dense_flags():
+    store = FaultStore(step=STEP)
+    timestamps, reference = fill(store, np.random.default_rng(0))
+    check(store, timestamps, reference)
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_load_append(tmp_path, mmap):
+    store = FaultStore(step=STEP)
+    timestamps, reference = fill(store, np.random.default_rng(1))
+    store.save(str(tmp_path / "rule"))
+    loaded = FaultStore.load(str(tmp_path / "rule"), mmap=mmap)
+    assert loaded.length == store.length
+    check(loaded, timestamps, reference)
+
+    stamps = timestamps[-1] + STEP * (1 + np.arange(10))
+    loaded.append(stamps, {target: np.ones(10, bool) for target in TARGETS})
+    timestamps = np.concatenate([timestamps, stamps])
+    reference = {target: np.concatenate([flags, np.ones(10, bool)]) for target, flags in reference.items()}
+    check(loaded, timestamps, reference)
+
+def test_append_out_of_order():
+    store = FaultStore(step=STEP)
+    store.append(STEP * np.arange(4), {TARGETS[0]: np.ones(4, bool)})
+    with pytest.raises(ValueError):
+        store.append(STEP * np.arange(4), {TARGETS[0]: np.ones(4, bool)})
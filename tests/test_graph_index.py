@@ -0,0 +1,77 @@
+import gc
+import weakref
+from rdflib import Graph, Literal, RDF, RDFS, URIRef
+from CQ_Specification import AHU_Tsa, BRICK
+from graph_index import ClassHierarchy, graph_cache, graph_version, hierarchy_for, invalidate
+from SeeQ import CQ, GraphCQ, is_applicable, resolve_bindings
+
+Tsa = CQ("Supply air temperature", None, [GraphCQ(0, [BRICK.AHU, BRICK.hasPoint, BRICK.Supply_Air_Temperature_Sensor])])
+
+
+def rule(g, tsa=Tsa):
+    return tsa
+
+
+def building(name: str) -> Graph:
+    # graphs which share an identifier, as when the same building is loaded twice
+    g = Graph(identifier=URIRef("urn:building"))
+    if name:
+        ahu, sensor = URIRef(f"urn:{name}"), URIRef(f"urn:{name}_sensor")
+        g.add((ahu, RDF.type, BRICK.AHU))
+        g.add((ahu, BRICK.hasPoint, sensor))
+        g.add((sensor, RDF.type, BRICK.Supply_Air_Temperature_Sensor))
+    else:
+        g.add((URIRef("urn:zone"), RDF.type, BRICK.HVAC_Zone))
+    return g
+
+
+def test_hierarchy_closure(brick):
+    hierarchy = hierarchy_for(brick)
+    assert BRICK.RTU in hierarchy.subclasses(BRICK.AHU)
+    assert BRICK.AHU in hierarchy.superclasses(BRICK.RTU) and BRICK.Equipment in hierarchy.superclasses(BRICK.RTU)
+    assert hierarchy_for(brick) is hierarchy
+
+def test_hierarchy_queries_match_subclass_paths(brick, test_model):
+    g = test_model + brick
+    for impl in AHU_Tsa.implementation:
+        assert impl.candidates(g, hierarchy_for(g)) == impl.candidates(g)
+
+def test_graphs_with_the_same_identifier_do_not_share_caches():
+    a, b, zones = building("A"), building("B"), building("")
+    for engine in ("native", "sparql"):
+        assert resolve_bindings(a, [rule], engine=engine)[rule] == {URIRef("urn:A"): {'tsa': URIRef("urn:A_sensor")}}
+        assert resolve_bindings(b, [rule], engine=engine)[rule] == {URIRef("urn:B"): {'tsa': URIRef("urn:B_sensor")}}
+        assert is_applicable(a, rule, engine=engine) and not is_applicable(zones, rule, engine=engine)
+    assert graph_cache(a) is not graph_cache(b)
+
+def test_version_follows_changes():
+    g = building("A")
+    store_class = type(g.store)
+    version = graph_version(g)
+    triple = (URIRef("urn:A"), RDFS.label, Literal("A"))
+    g.add(triple)
+    added = graph_version(g)
+    g.remove(triple)
+    removed = graph_version(g)
+    # the same triples as at first, but the changes are seen
+    assert len({version, added, removed}) == 3
+    invalidate(g)
+    assert graph_version(g) != removed
+    assert type(g.store) is store_class
+
+def test_same_count_edit_drops_the_cache():
+    g = building("A")
+    cache = graph_cache(g)
+    g.remove((URIRef("urn:A"), BRICK.hasPoint, URIRef("urn:A_sensor")))
+    g.add((URIRef("urn:A"), RDFS.seeAlso, URIRef("urn:A_sensor")))
+    assert graph_cache(g) is not cache
+    assert resolve_bindings(g, [rule], engine="native")[rule] == {}
+
+def test_compiled_queries_do_not_keep_hierarchies():
+    hierarchy = ClassHierarchy(Graph())
+    alive = weakref.ref(hierarchy)
+    AHU_Tsa.implementation[0].compile(hierarchy)
+    AHU_Tsa.compile_union(list(enumerate(AHU_Tsa.implementation)), hierarchy)
+    del hierarchy
+    gc.collect()
+    assert alive() is None
@@ -0,0 +1,8 @@
+from import_time import LAZY, MODULES, loaded
+
+
+def test_optional_dependencies_are_not_imported_eagerly():
+    for module in MODULES:
+        assert loaded(module, LAZY) == []
+    # the check sees the modules imported on first use
+    assert "pyshacl" in loaded("SeeQ, pyshacl", LAZY)
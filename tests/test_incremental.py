@@ -0,0 +1,51 @@
+import random
+import pytest
+from rdflib import RDF
+from CQ_Specification import BRICK, AHU_Tma, AHU_Tra, AHU_Tsa, Epsilon_t, VAV_Tsa
+from incremental import IncrementalResolver
+from ontology import building_graph
+from SeeQ import resolve_bindings
+from synthetic import generate_model
+
+
+def rule1(g, sat=AHU_Tsa, mat=AHU_Tma, eps=Epsilon_t):
+    return mat < sat + eps
+
+def rule3(g, rat=AHU_Tra, sat=AHU_Tsa):
+    return rat > sat
+
+def rule4(g, tsa=VAV_Tsa):
+    return tsa > 3
+
+RULES = [rule1, rule3, rule4]
+PREDICATES = [BRICK.hasPoint, BRICK.hasPart, BRICK.feeds, BRICK.isPartOf, RDF.type]
+CLASSES = [BRICK.AHU, BRICK.Supply_Air_Temperature_Sensor, BRICK.Fan, BRICK.VAV, BRICK.Mixed_Air_Temperature_Sensor]
+
+
+@pytest.mark.parametrize("engine", ["sparql", "native"])
+@pytest.mark.parametrize("inference", [False, True])
+def test_updates_match_fresh_resolution(brick, engine, inference):
+    building = generate_model(4, 2, 2, seed=2)
+    resolver = IncrementalResolver(building_graph(building, brick), RULES, inference, engine)
+    rng = random.Random(3)
+    for _ in range(15):
+        triples = list(building)
+        removed = [rng.choice(triples)] if rng.random() < 0.6 else []
+        added = []
+        if rng.random() < 0.6:
+            predicate = rng.choice(PREDICATES)
+            obj = rng.choice(CLASSES) if predicate == RDF.type else rng.choice(triples)[2]
+            added = [(rng.choice(triples)[0], predicate, obj)]
+        resolver.update(added=added, removed=removed)
+        fresh = resolve_bindings(building_graph(building, brick), RULES, inference, engine)
+        for fn in RULES:
+            assert resolver.bindings[fn] == fresh[fn]
+
+def test_diff_of_a_removed_point(brick):
+    building = generate_model(2, 1, 1, seed=0)
+    resolver = IncrementalResolver(building_graph(building, brick), [rule4], inference=True, engine="native")
+    target, binding = next(iter(resolver.bindings[rule4].items()))
+    diff = resolver.update(removed=[(target, BRICK.hasPoint, binding['tsa'])])
+    assert target in diff.removed[rule4] and target not in resolver.bindings[rule4]
+    diff = resolver.update(added=[(target, BRICK.hasPoint, binding['tsa'])])
+    assert diff.added[rule4] == {target: binding}
@@ -0,0 +1,43 @@
+import json
+import pytest
+from CQ_Specification import AHU_Tma, AHU_Tsa, Epsilon_t, VAV_Tsa, VAV_Tzone
+from instrumentation import ResolutionStats
+from ontology import building_graph
+from SeeQ import GraphCQ, resolve_bindings
+
+
+def rule1(g, sat=AHU_Tsa, mat=AHU_Tma, eps=Epsilon_t):
+    return mat > sat + eps
+
+def rule2(g, tsa=VAV_Tsa, tz=VAV_Tzone):
+    return tsa < tz
+
+
+@pytest.mark.parametrize("engine", ["sparql", "native"])
+def test_stats_of_a_resolution(brick, test_model, engine):
+    records = []
+    stats = ResolutionStats(hook=records.append)
+    g = building_graph(test_model, brick)
+    bindings = resolve_bindings(g, [rule1, rule2], True, engine, stats=stats)
+    assert bindings == resolve_bindings(g, [rule1, rule2], True, engine)
+    # every implementation is measured, with both engines
+    for cq in (AHU_Tsa, AHU_Tma, VAV_Tsa, VAV_Tzone):
+        for impl in cq.implementation:
+            if isinstance(impl, GraphCQ):
+                entry = stats.implementations[ResolutionStats.label(impl)]
+                assert entry['engine'] == engine and entry['calls'] == 1
+                assert entry['rows'] >= entry['candidates'] >= 0
+    assert stats.implementations[ResolutionStats.label(AHU_Tsa.implementation[0])]['candidates'] > 0
+
+    rule = stats.rules['rule1']
+    assert rule['targets'] == len(bindings[rule1]) > 0 and not rule['cached']
+    assert sum(rule['usage']['sat'].values()) == rule['targets']
+    assert set(rule['chosen']) == {str(target) for target in bindings[rule1]}
+    assert all(set(indexes) >= {'sat', 'mat'} for indexes in rule['chosen'].values())
+    # rule2 does not run on test_model: its failures say which CQs did not resolve
+    failed = stats.rules['rule2']
+    assert failed['targets'] == 0 and failed['failed'] == len(failed['failures']) > 0
+    assert all(reason.startswith("no implementation of") for reason in failed['failures'].values())
+
+    assert [record['event'] for record in records].count('rule') == 2
+    assert json.loads(stats.to_json()) == json.loads(json.dumps(stats.as_dict()))
@@ -0,0 +1,60 @@
+import json
+import os
+from rdflib import Graph, Literal, RDFS, URIRef
+from rdflib.compare import isomorphic
+from graph_index import graph_fingerprint
+import ontology
+
+TTL = '''
+@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+@prefix ex: <urn:ex#> .
+ex:B rdfs:subClassOf ex:A ;
+    rdfs:label "B"@en, """two
+lines""" ;
+    ex:size 3 ;
+    ex:restriction [ ex:on ex:p ; ex:value [ ex:min 1.5 ] ] .
+'''
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "onto.ttl")
+    with open(path, "w") as f:
+        f.write(TTL)
+    parsed = ontology.load_ontology(path)
+    assert os.path.exists(f"{path}.snapshot") and os.path.exists(f"{path}.snapshot.npy")
+    with open(f"{path}.snapshot") as f:
+        assert json.load(f)['version'] == ontology.SNAPSHOT_VERSION
+
+    loaded = ontology._read_snapshot(os.path.abspath(path))
+    assert loaded is not None and isomorphic(loaded, parsed)
+    assert (URIRef("urn:ex#B"), RDFS.label, Literal("two\nlines")) in loaded
+    fingerprint = graph_fingerprint(loaded)
+    copy = Graph()
+    copy += loaded
+    assert graph_fingerprint(copy) == fingerprint
+
+def test_invalid_snapshot_is_ignored(tmp_path):
+    path = str(tmp_path / "onto.ttl")
+    with open(path, "w") as f:
+        f.write(TTL)
+    g = ontology.load_ontology(path)
+    with open(f"{path}.snapshot", "wb") as f:
+        f.write(b"\x80\x04not a snapshot")
+    assert ontology._read_snapshot(os.path.abspath(path)) is None
+    # a snapshot of an older version of the file
+    ontology._write_snapshot(g, os.path.abspath(path))
+    os.utime(path, ns=(0, 0))
+    assert ontology._read_snapshot(os.path.abspath(path)) is None
+
+def test_union_counts_shared_triples_once():
+    onto = Graph()
+    onto.parse(data=TTL, format="turtle")
+    building = Graph()
+    building.add((URIRef("urn:ex#b1"), RDFS.label, Literal("b1")))
+    g = ontology.building_graph(building, onto)
+    assert len(g) == len(set(g)) == len(onto) + 1
+    # a triple of the ontology added to the building
+    building.add((URIRef("urn:ex#B"), RDFS.subClassOf, URIRef("urn:ex#A")))
+    assert len(g) == len(set(g)) == len(onto) + 1
+    building.add((URIRef("urn:ex#b2"), RDFS.label, Literal("b2")))
+    assert len(g) == len(set(g)) == len(onto) + 2
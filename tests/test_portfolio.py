@@ -0,0 +1,26 @@
+import os
+from CQ_Specification import AHU_Tsa, Epsilon_t, VAV_Tsa, VAV_Tzone
+from portfolio import resolve_portfolio
+from SeeQ import resolve_bindings
+from synthetic import generate_model
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# the applications are sent to the worker processes, so they are defined at the top level
+def rule1(g, sat=AHU_Tsa, eps=Epsilon_t):
+    return sat > eps
+
+def rule2(g, tsa=VAV_Tsa, tz=VAV_Tzone):
+    return tsa < tz
+
+
+def test_portfolio_matches_resolve_bindings(test_model):
+    # without a shared ontology: the buildings are resolved on their own triples
+    sources = [os.path.join(ROOT, "test_model.ttl"), generate_model(3, 2, 1, seed=0)]
+    results = resolve_portfolio(sources, [rule1, rule2], ontology=None, max_workers=2)
+    assert len(results) == 2
+    for g, result in zip([test_model, sources[1]], results):
+        expected = resolve_bindings(g, [rule1, rule2])
+        assert result == {f"{__name__}.rule1": expected[rule1], f"{__name__}.rule2": expected[rule2]}
+    assert results[0][f"{__name__}.rule1"] and results[1][f"{__name__}.rule1"]
@@ -0,0 +1,147 @@
+import random
+import pytest
+from rdflib import Graph, RDF, RDFS
+import CQ_Specification
+from CQ_Specification import BRICK, AHU_Tma, AHU_Tsa, Epsilon_t, VAV_Tsa, VAV_Tzone
+from graph_index import graph_parts, hierarchy_for, index_for
+from instrumentation import ResolutionStats
+from ontology import building_graph
+from SeeQ import CQ, DefaultCQ, GraphCQ, get_cqs, is_applicable, resolve, resolve_bindings, resolve_many
+from synthetic import SYN, generate_model
+
+# the CQs of the specification whose implementations are all GraphCQs or DefaultCQs
+CQS = [cq for cq in vars(CQ_Specification).values()
+       if type(cq) is CQ and cq.implementation and all(isinstance(impl, (GraphCQ, DefaultCQ)) for impl in cq.implementation)]
+IMPLEMENTATIONS = [impl for cq in CQS for impl in cq.implementation if isinstance(impl, GraphCQ)]
+
+
+def rule1(g, sat=AHU_Tsa, mat=AHU_Tma, eps=Epsilon_t):
+    return mat > sat + eps
+
+def rule2(g, tsa=VAV_Tsa, tz=VAV_Tzone):
+    return tsa < tz
+
+def rule3(g, sat=AHU_Tsa, eps=Epsilon_t):
+    return sat > eps
+
+
+def several_points(ahus: int = 8) -> Graph:
+    # a synthetic model in which every AHU has 3 more supply air temperature sensors,
+    # added in a random order
+    g = generate_model(ahus, 1, 1, seed=0)
+    extra = [(a, i) for a in range(ahus) for i in range(3)]
+    random.Random(0).shuffle(extra)
+    for a, i in extra:
+        point = SYN[f"SA_TEMP_{a}_{i}"]
+        g.add((point, RDF.type, BRICK.Supply_Air_Temperature_Sensor))
+        g.add((SYN[f"AHU_{a}"], BRICK.hasPoint, point))
+    return g
+
+@pytest.fixture(params=["test_model", "synthetic"])
+def building(request, test_model) -> Graph:
+    return test_model if request.param == "test_model" else generate_model(5, 3, 2, seed=0)
+
+@pytest.fixture
+def merged(brick, test_model) -> Graph:
+    # the building and the ontology in one graph, as in the README
+    g = Graph()
+    g += test_model
+    g += brick
+    return g
+
+def test_candidates_match_per_target_queries(merged):
+    for impl in IMPLEMENTATIONS:
+        candidates = impl.candidates(merged)
+        targets = {row['target'] for row in merged.query(impl.compiled)}
+        assert set(candidates) == targets
+        for target, point in candidates.items():
+            # what one query per target returned before
+            row = next(iter(merged.query(impl.compiled, initBindings={'target': target})))
+            assert row.get('point') == point
+        assert impl.candidates(merged, targets=list(candidates)[:1]) == dict(list(candidates.items())[:1])
+
+@pytest.mark.parametrize("inference", [False, True])
+def test_engines_choose_the_same_point(brick, inference):
+    g = building_graph(several_points(), brick)
+    hierarchy = hierarchy_for(g) if inference else None
+    for impl in AHU_Tsa.implementation:
+        assert impl.candidates(g, hierarchy, "native") == impl.candidates(g, hierarchy, "sparql")
+    assert AHU_Tsa.ranked(g, hierarchy, "native") == AHU_Tsa.ranked(g, hierarchy, "sparql")
+    native = resolve_bindings(g, [rule1], inference, "native")[rule1]
+    assert native == resolve_bindings(g, [rule1], inference, "sparql")[rule1]
+    assert len(native) > 4
+    for target, binding in native.items():
+        sensors = [point for point in g.objects(target, BRICK.hasPoint)
+                   if (point, RDF.type, BRICK.Supply_Air_Temperature_Sensor) in g]
+        assert binding['sat'] == min(sensors, key=lambda point: point.n3())
+
+@pytest.mark.parametrize("engine", ["sparql", "native"])
+def test_shared_cqs_are_resolved_once(brick, test_model, monkeypatch, engine):
+    g = building_graph(test_model, brick)
+    resolved = []
+    ranked = CQ.ranked
+    def counted(cq, *args, **kwargs):
+        resolved.append(cq.key)
+        return ranked(cq, *args, **kwargs)
+    monkeypatch.setattr(CQ, "ranked", counted)
+    many = resolve_many(g, [rule1, rule2, rule3], True, engine)
+    # AHU_Tsa and Epsilon_t are shared by rule1 and rule3
+    assert len(resolved) == len(set(resolved))
+    assert set(resolved) == {cq.key for fn in (rule1, rule2, rule3) for cq in get_cqs(fn).values()}
+    for fn in (rule1, rule2, rule3):
+        assert [f.keywords for f in many[fn]] == [f.keywords for f in resolve(g, fn, True, engine)]
+    assert many[rule1] and many[rule3] and not many[rule2]
+
+@pytest.mark.parametrize("engine", ["sparql", "native"])
+@pytest.mark.parametrize("inference", [False, True])
+def test_ranked_matches_implementations(brick, building, engine, inference):
+    # the UNION query of CQ.ranked picks the same points as the implementations one by one
+    g = building_graph(building, brick)
+    hierarchy = hierarchy_for(g) if inference else None
+    for cq in CQS:
+        expected = {}
+        for index, impl in enumerate(cq.implementation):
+            if isinstance(impl, DefaultCQ):
+                break
+            for target, point in impl.candidates(g, hierarchy, "sparql").items():
+                expected.setdefault(target, (index, point))
+        assert cq.ranked(g, hierarchy, engine)[0] == expected
+        assert cq.ranked(g, hierarchy, engine, ResolutionStats())[0] == expected
+
+@pytest.mark.parametrize("engine", ["sparql", "native"])
+@pytest.mark.parametrize("inference", [False, True])
+def test_pruned_resolution_matches_full(brick, building, engine, inference):
+    full = resolve_bindings(building_graph(building, brick), [rule1, rule2], inference, engine)
+    pruned = resolve_bindings(building_graph(building, brick), [rule1, rule2], inference, engine, prune=True)
+    assert full == pruned
+
+
+def detach(g: Graph, target) -> None:
+    # moves the relations of the target to rdfs:seeAlso: the number of triples does not change
+    building = graph_parts(g)[0]
+    for predicate, obj in list(building.predicate_objects(target)):
+        if predicate != RDF.type:
+            building.remove((target, predicate, obj))
+            building.add((target, RDFS.seeAlso, obj))
+
+@pytest.mark.parametrize("engine", ["sparql", "native"])
+def test_qualify_matches_candidates(brick, test_model, engine):
+    # the existence check answers whether the implementation has any candidate
+    g = building_graph(test_model, brick)
+    for impl in IMPLEMENTATIONS:
+        assert impl.qualify(g, engine=engine) == bool(impl.candidates(g, engine=engine))
+    assert is_applicable(g, rule1, engine=engine) and not is_applicable(g, rule2, engine=engine)
+
+@pytest.mark.parametrize("engine", ["sparql", "native"])
+def test_same_count_edit_invalidates_memos(brick, test_model, engine):
+    g = building_graph(test_model, brick)
+    bindings = resolve_bindings(g, [rule1], True, engine)[rule1]
+    assert bindings and is_applicable(g, rule1, engine=engine)
+    index = index_for(g)
+    count = len(g)
+    for subject in set(graph_parts(g)[0].subjects()):
+        detach(g, subject)
+    assert len(g) == count
+    assert index_for(g) is not index
+    assert not is_applicable(g, rule1, engine=engine)
+    assert resolve_bindings(g, [rule1], True, engine)[rule1] == {}
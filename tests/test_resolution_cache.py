@@ -0,0 +1,61 @@
+from rdflib import Graph, Literal, RDF, RDFS
+import graph_index
+from CQ_Specification import AHU_Tma, AHU_Tsa, Epsilon_t
+from graph_index import graph_fingerprint, graph_parts, graph_version
+from ontology import building_graph
+from resolution_cache import ResolutionCache
+from SeeQ import resolve_bindings
+
+
+def rule1(g, sat=AHU_Tsa, mat=AHU_Tma, eps=Epsilon_t):
+    return mat > sat + eps
+
+
+def test_same_count_edit_changes_version(test_model):
+    version, fingerprint = graph_version(test_model), graph_fingerprint(test_model)
+    subject = next(iter(test_model.subjects()))
+    test_model.add((subject, RDFS.comment, Literal("a")))
+    test_model.remove((subject, RDFS.comment, Literal("a")))
+    assert graph_version(test_model) != version
+    assert graph_fingerprint(test_model) == fingerprint
+    test_model.add((subject, RDFS.comment, Literal("b")))
+    test_model.remove(next(triple for triple in test_model if triple[1] != RDFS.comment))
+    assert graph_fingerprint(test_model) != fingerprint
+
+def test_fingerprint_ignores_blank_node_ids():
+    def graph(label):
+        g = Graph()
+        g.parse(data=f'<urn:a> <urn:p> [ <urn:q> [ <urn:r> "{label}" ] ] .', format="turtle")
+        return g
+    assert graph_fingerprint(graph("x")) == graph_fingerprint(graph("x"))
+    assert graph_fingerprint(graph("x")) != graph_fingerprint(graph("y"))
+
+def test_union_fingerprint_reuses_the_ontology(brick, test_model, monkeypatch):
+    g = building_graph(test_model, brick)
+    building, ontology = graph_parts(g)
+    assert ontology is brick
+    fingerprint = graph_fingerprint(g)
+    assert graph_fingerprint(building_graph(test_model, brick)) == fingerprint
+    # a change of the building changes the fingerprint, without hashing the ontology again
+    hashed = []
+    triple_hash = graph_index._triple_hash
+    monkeypatch.setattr(graph_index, "_triple_hash", lambda *args: hashed.append(1) or triple_hash(*args))
+    subject = next(iter(test_model.subjects()))
+    test_model.add((subject, RDFS.comment, Literal("a")))
+    assert graph_fingerprint(g) != fingerprint
+    assert len(hashed) == len(test_model)
+
+def test_same_count_edit_misses_resolution_cache(brick, test_model):
+    g = building_graph(test_model, brick)
+    cache = ResolutionCache(":memory:")
+    bindings = resolve_bindings(g, [rule1], True, cache=cache)[rule1]
+    assert resolve_bindings(g, [rule1], True, cache=cache)[rule1] == bindings
+    assert cache.hits == 1
+    for target in bindings:
+        # the relations of the target move to rdfs:seeAlso: the number of triples does not change
+        for predicate, obj in list(test_model.predicate_objects(target)):
+            if predicate != RDF.type:
+                test_model.remove((target, predicate, obj))
+                test_model.add((target, RDFS.seeAlso, obj))
+    assert resolve_bindings(g, [rule1], True, cache=cache)[rule1] == {}
+    assert cache.hits == 1
@@ -0,0 +1,75 @@
+import asyncio
+import gc
+import threading
+import weakref
+from rdflib import Graph, RDF, URIRef
+from CQ_Specification import BRICK
+from SeeQ import CQ, GraphCQ, resolve_bindings
+from service import ResolutionService
+
+Tsa = CQ("Supply air temperature", None, [GraphCQ(0, [BRICK.AHU, BRICK.hasPoint, BRICK.Supply_Air_Temperature_Sensor])])
+
+
+def rule(g, tsa=Tsa):
+    return tsa
+
+
+def building(name: str) -> Graph:
+    g = Graph()
+    ahu, sensor = URIRef(f"urn:{name}"), URIRef(f"urn:{name}_sensor")
+    g.add((ahu, RDF.type, BRICK.AHU))
+    g.add((ahu, BRICK.hasPoint, sensor))
+    g.add((sensor, RDF.type, BRICK.Supply_Air_Temperature_Sensor))
+    return g
+
+
+def test_identical_requests_are_coalesced_and_cached():
+    async def main():
+        service = ResolutionService(max_workers=2)
+        g = building("A")
+        first, second = await asyncio.gather(service.resolve(g, rule), service.resolve(g, rule))
+        assert first is second and first == resolve_bindings(g, [rule])[rule]
+        assert (service.misses, service.coalesced, service.hits) == (1, 1, 0)
+        assert await service.resolve(g, rule) is first and service.hits == 1
+        assert await service.is_applicable(g, rule) and service.misses == 2
+        # a new version of the graph is resolved again
+        g.add((URIRef("urn:A"), BRICK.hasPoint, URIRef("urn:A_other")))
+        assert await service.resolve(g, rule) == first and service.misses == 3
+        service.close()
+    asyncio.run(main())
+
+def test_cache_evicts_the_least_recently_used():
+    async def main():
+        service = ResolutionService(max_workers=1, cache_size=2)
+        a, b, c = building("A"), building("B"), building("C")
+        await service.resolve(a, rule)
+        await service.resolve(b, rule)
+        await service.resolve(a, rule)
+        await service.resolve(c, rule)
+        assert len(service.cache) == 2 and service.hits == 1
+        await service.resolve(a, rule)
+        assert service.hits == 2
+        await service.resolve(b, rule)
+        assert service.misses == 4
+        service.close()
+    asyncio.run(main())
+
+def test_results_of_collected_graphs_are_dropped():
+    async def main():
+        service = ResolutionService(max_workers=1)
+        await service.resolve(building("A"), rule)
+        kept = building("B")
+        await service.resolve(kept, rule)
+        # the graph is collected in another thread: the cache is only changed on the loop
+        thread = threading.Thread(target=gc.collect)
+        thread.start()
+        thread.join()
+        assert len(service.cache) == 2
+        await service.is_applicable(kept, rule)
+        assert [key[0] for key in service.cache] == [id(kept), id(kept)]
+        service.close()
+        return weakref.ref(service)
+    alive = asyncio.run(main())
+    gc.collect()
+    # the finalizers of the graphs do not keep the service alive
+    assert alive() is None
@@ -0,0 +1,42 @@
+import pickle
+import pytest
+import CQ_Specification
+from CQ_Specification import AHU_Tsa, BRICK
+from SeeQ import CQ, GCQ, GraphCQ
+from shape_to_query import compile_query, pattern_to_query, shape_to_query
+
+PATTERN = [BRICK.AHU, BRICK.hasPart, BRICK.Fan, BRICK.hasPoint, BRICK.Supply_Air_Temperature_Sensor]
+
+
+def test_query_text_is_deterministic():
+    first, second = GraphCQ(1, PATTERN), GraphCQ(1, PATTERN)
+    text = pattern_to_query(*first.pattern)
+    assert text == pattern_to_query(*second.pattern)
+    assert "?v0" in text and "?point" in text and "?target" in text
+    # the same text as the query of the SHACL shape of the pattern
+    assert text == shape_to_query(first.shape, GCQ[first.description])
+
+def test_same_shapes_share_one_prepared_query():
+    assert GraphCQ(1, PATTERN).compiled is GraphCQ(1, PATTERN).compiled
+    assert GraphCQ(1, PATTERN).compiled is AHU_Tsa.implementation[1].compiled
+    assert GraphCQ(0, PATTERN).compiled is not GraphCQ(1, PATTERN).compiled
+    assert compile_query(pattern_to_query(*GraphCQ(1, PATTERN).pattern, ask=True)) is GraphCQ(1, PATTERN).compile(ask=True)
+
+def test_patterns_compare_by_value():
+    pattern = GraphCQ(1, PATTERN).pattern
+    assert pattern == GraphCQ(1, list(PATTERN)).pattern and hash(pattern) == hash(GraphCQ(1, PATTERN).pattern)
+    assert pattern != GraphCQ(0, PATTERN).pattern
+    assert pattern.targets == (BRICK.AHU,) and pattern.points == (1,)
+    assert pattern.steps == ((BRICK.hasPart, BRICK.Fan), (BRICK.hasPoint, BRICK.Supply_Air_Temperature_Sensor))
+    with pytest.raises(AttributeError):
+        pattern.points = (0,)
+    copy = pickle.loads(pickle.dumps(pattern))
+    assert copy == pattern and hash(copy) == hash(pattern) and copy is not pattern
+
+def test_shapes_give_the_queries_of_their_patterns():
+    # the SHACL shape built from a pattern is compiled to the query generated from the pattern
+    for cq in vars(CQ_Specification).values():
+        if isinstance(cq, CQ) and not isinstance(cq, GraphCQ):
+            for impl in cq.implementation:
+                if isinstance(impl, GraphCQ):
+                    assert shape_to_query(impl.shape, GCQ[impl.description]) == pattern_to_query(*impl.pattern)
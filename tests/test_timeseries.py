@@ -0,0 +1,58 @@
+import csv
+import numpy as np
+import pytest
+from timeseries import ArraySource, BulkFetcher, CSVSource
+
+POINTS = [f"urn:p{i}" for i in range(600)]
+STEP = 60.0
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / "series.csv"
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["timestamp"] + POINTS)
+        for i in range(200):
+            writer.writerow([i * STEP] + [i + j for j in range(len(POINTS))])
+    return str(path)
+
+def counting(source: CSVSource) -> list:
+    restarts = []
+    restart = source._restart
+    source._restart = lambda: (restarts.append(1), restart())
+    return restarts
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_bulk_reads_of_a_csv_never_rewind(csv_path, batched):
+    source = CSVSource(csv_path)
+    # batched=True forces batches of the range, which are then served from the rows in memory
+    source.batched = batched
+    restarts = counting(source)
+    fetcher = BulkFetcher(source)
+    for start in np.arange(0, 200 * STEP, 10 * STEP):
+        timestamps, data = fetcher.read(POINTS, start, start + 10 * STEP)
+        rows = np.arange(10) + start / STEP
+        assert np.array_equal(timestamps, rows * STEP)
+        assert np.array_equal(data[POINTS[599]], rows + 599)
+    assert len(restarts) == 1
+    assert fetcher.reads == (40 if batched else 20)
+
+def test_csv_reads_back_in_time_restart(csv_path):
+    source = CSVSource(csv_path)
+    restarts = counting(source)
+    source.read(POINTS[:1], 0, 600)
+    source.read(POINTS[:1], 600, 1200)
+    timestamps, data = source.read(POINTS[:2], 0, 120)
+    assert len(restarts) == 2
+    assert np.array_equal(data[POINTS[1]], [1, 2])
+
+def test_bulk_fetcher_batches_and_caches():
+    timestamps = np.arange(100) * STEP
+    source = ArraySource(timestamps, {point: np.full(100, i, float) for i, point in enumerate(POINTS)})
+    fetcher = BulkFetcher(source, batch_size=250, max_workers=3)
+    _, data = fetcher.read(POINTS[:300], 0, 50 * STEP)
+    assert fetcher.reads == 2
+    _, data = fetcher.read(POINTS, 0, 50 * STEP)
+    assert fetcher.reads == 4 and np.array_equal(data[POINTS[450]], np.full(50, 450.0))
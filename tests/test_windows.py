@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+import windows
+from CQ_Specification import AHU_Tma, AHU_Tsa, Epsilon_t
+from SeeQ import evaluate, get_cqs
+
+# uneven chunks, including empty ones
+CHUNKS = [(0, 1), (1, 1), (1, 50), (50, 51), (51, 333), (333, 500)]
+
+rng = np.random.default_rng(1)
+X = rng.random((3, 500)) * 10
+X[0, 37] = np.nan
+CONDITION = X > 4
+
+KERNELS = [
+    (windows.rolling_mean, X, (7,)),
+    (windows.rolling_min, X, (3,)),
+    (windows.rolling_max, X, (1,)),
+    (windows.duration, CONDITION, ()),
+    (windows.persists, CONDITION, (3,)),
+    (windows.hysteresis, X, (7, 3)),
+]
+
+
+def rule(g, sat=AHU_Tsa, mat=AHU_Tma, eps=Epsilon_t):
+    return (mat > sat + eps).persists(5) & (mat - sat).rolling_mean(3).hysteresis(eps, eps / 2)
+
+
+@pytest.mark.parametrize("kernel, x, args", KERNELS, ids=lambda value: getattr(value, '__name__', ''))
+def test_chunked_matches_whole(kernel, x, args):
+    whole = kernel(x, *args)[0]
+    state, parts = None, []
+    for lo, hi in CHUNKS:
+        part, state = kernel(x[..., lo:hi], *args, state=state)
+        parts.append(part)
+    assert np.array_equal(np.concatenate(parts, axis=-1), whole, equal_nan=True)
+    # rows are independent series
+    assert np.array_equal(kernel(x[1], *args)[0], whole[1], equal_nan=True)
+
+def test_rolling_mean_matches_pandas():
+    assert np.allclose(windows.rolling_mean(X[1], 7)[0][6:], pd.Series(X[1]).rolling(7).mean().values[6:])
+
+def test_hysteresis_and_duration_references():
+    on, held, expected = False, [], []
+    for value in X[1]:
+        on = True if value > 7 else False if value < 3 else on
+        held.append(on)
+    run = 0
+    for value in CONDITION[2]:
+        run = run + 1 if value else 0
+        expected.append(run)
+    assert np.array_equal(windows.hysteresis(X[1], 7, 3)[0], held)
+    assert np.array_equal(windows.duration(CONDITION[2])[0], expected)
+
+def test_expression_chunked_matches_whole():
+    cqs, expression = get_cqs(rule), rule(None)
+    mat, sat = rng.random(1000) * 10, rng.random(1000) * 5
+    whole = evaluate(expression, {cqs['mat']: mat, cqs['sat']: sat})
+    state = {}
+    parts = [evaluate(expression, {cqs['mat']: mat[i:i + 77], cqs['sat']: sat[i:i + 77]}, state)
+             for i in range(0, 1000, 77)]
+    assert np.array_equal(np.concatenate(parts), whole)
+    assert evaluate(expression, {cqs['mat']: pd.Series(mat), cqs['sat']: pd.Series(sat)}).sum() == whole.sum()
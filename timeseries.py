@@ -0,0 +1,267 @@
+'''
+Time-series sources for the execution of resolved applications (see execution.py).
+
+A source returns the measurements of a set of points over a time range [start, end),
+aligned on common timestamps:
+
+    timestamps, data = source.read(["http://...#SA_TEMP", "http://...#MA_TEMP"], start, end)
+    timestamps                  -> sorted array of the timestamps found in the range
+    data["http://...#SA_TEMP"]  -> array of the same length (NaN where there is no value)
+
+Points are identified by the string of their URI, and timestamps are numbers (e.g.
+epoch seconds). Sources are read one time range (chunk) at a time, so that memory
+stays bounded regardless of the length of the history.
+
+Sources are the pluggable backends of a BulkFetcher, which sits between them and the
+executor: it fetches the union of the points needed by all the applications in batches
+(one ranged query per batch), and caches the arrays so that a point shared by many
+applications and targets is fetched once per time range.
+
+Classes:
+-    ArraySource: in-memory arrays (e.g. the columns of a dataframe)
+-      CSVSource: a CSV file with a timestamp column and one column per point
+-   SQLiteSource: a SQLite table of (point, timestamp, value) rows
+- ConnectionPool: a pool of SQLite connections, shared by the reads of a SQLiteSource
+-    BulkFetcher: batched, deduplicated and cached reads from a source
+'''
+import csv
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Tuple
+import numpy as np
+
+Series = Tuple[np.ndarray, Dict[str, np.ndarray]]
+
+
+def align(rows: Iterable[Tuple[str, float, float]], points: List[str]) -> Series:
+    """
+    Aligns (point, timestamp, value) rows on the union of their timestamps
+    """
+    rows = list(rows)
+    if not rows:
+        return np.empty(0), {point: np.empty(0) for point in points}
+    names, stamps, values = zip(*rows)
+    timestamps, position = np.unique(np.asarray(stamps, dtype=float), return_inverse=True)
+    index = {point: i for i, point in enumerate(points)}
+    matrix = np.full((len(points), len(timestamps)), np.nan)
+    matrix[[index[name] for name in names], position] = np.asarray(values, dtype=float)
+    return timestamps, dict(zip(points, matrix))
+
+def merge(parts: List[Series]) -> Series:
+    """
+    Merges aligned series (e.g. the batches of a BulkFetcher) on the union of their timestamps
+    """
+    if len(parts) == 1:
+        return parts[0]
+    timestamps = np.unique(np.concatenate([stamps for stamps, _ in parts])) if parts else np.empty(0)
+    data = {}
+    for stamps, values in parts:
+        position = np.searchsorted(timestamps, stamps)
+        for point, series in values.items():
+            if len(stamps) == len(timestamps):
+                data[point] = series
+            else:
+                data[point] = np.full(len(timestamps), np.nan)
+                data[point][position] = series
+    return timestamps, data
+
+
+class ArraySource:
+    """
+    Measurements held in memory: one array of timestamps, and one array of values per point
+    """
+    def __init__(self, timestamps, values: Dict[str, np.ndarray]):
+        order = np.argsort(timestamps, kind="stable")
+        self.timestamps = np.asarray(timestamps)[order]
+        self.values = {str(point): np.asarray(series, dtype=float)[order] for point, series in values.items()}
+
+    def read(self, points: List[str], start: float, end: float) -> Series:
+        lo, hi = np.searchsorted(self.timestamps, [start, end], side="left")
+        missing = np.full(hi - lo, np.nan)
+        return self.timestamps[lo:hi], {point: self.values[point][lo:hi] if point in self.values else missing
+                                        for point in points}
+
+
+class CSVSource:
+    """
+    A CSV file with a `time_column` and one column per point (named by its URI), sorted by time.
+    The file is read sequentially: consecutive reads of increasing time ranges never re-read
+    rows, and only the rows of the current range are kept in memory. Reads of the current
+    range (e.g. for other points) are served from these rows. The file is read in one pass
+    per range, so a BulkFetcher does not split the points of a CSVSource into batches.
+    """
+    batched = False
+
+    def __init__(self, path: str, time_column: str = "timestamp"):
+        self.path = path
+        self.time_column = time_column
+        self._file = None
+        self._reader = None
+        self._pending = None
+        self._position = None
+        self._range = None
+        self._rows = []
+
+    def _restart(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, newline="")
+        self._reader = csv.DictReader(self._file)
+        self._pending = None
+        self._position = None
+
+    def read(self, points: List[str], start: float, end: float) -> Series:
+        if self._range == (start, end):
+            return self._series(self._rows, points)
+        if self._reader is None or self._position is None or start < self._position:
+            self._restart()
+        rows = []
+        while True:
+            row = self._pending if self._pending is not None else next(self._reader, None)
+            self._pending = None
+            if row is None:
+                break
+            stamp = float(row[self.time_column])
+            if stamp >= end:
+                self._pending = row
+                break
+            if stamp >= start:
+                rows.append((stamp, row))
+        self._position = end
+        self._range, self._rows = (start, end), rows
+        return self._series(rows, points)
+
+    def _series(self, rows: List[Tuple[float, Dict]], points: List[str]) -> Series:
+        timestamps = np.array([stamp for stamp, _ in rows], dtype=float)
+        data = {point: np.array([float(row[point]) if row.get(point) not in (None, "") else np.nan
+                                 for _, row in rows], dtype=float)
+                for point in points}
+        return timestamps, data
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = self._reader = None
+            self._range, self._rows = None, []
+
+
+class ConnectionPool:
+    """
+    A fixed-size pool of SQLite connections. Connections are opened lazily and reused,
+    instead of opening a connection per query.
+
+    with pool.connection() as connection:
+        connection.execute(...)
+    """
+    def __init__(self, path: str, size: int = 4):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                opening = self._opened < self.size
+                if opening:
+                    self._opened += 1
+            if opening:
+                connection = sqlite3.connect(self.path, check_same_thread=False)
+            else:
+                connection = self._idle.get()
+        try:
+            yield connection
+        finally:
+            self._idle.put(connection)
+
+    def close(self) -> None:
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+        self._opened = 0
+
+
+class SQLiteSource:
+    """
+    A SQLite table of (point, timestamp, value) rows, e.g. a local copy of a historian.
+    Reads go through a ConnectionPool, so that concurrent batches (see BulkFetcher) do not
+    share a connection. An index on (point, timestamp) is created if it does not exist.
+    """
+    def __init__(self, path: str, table: str = "timeseries", pool_size: int = 4):
+        self.path = path
+        self.table = table
+        self.pool = ConnectionPool(path, pool_size)
+        with self.pool.connection() as connection:
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_point_timestamp ON {table} (point, timestamp)")
+
+    def read(self, points: List[str], start: float, end: float) -> Series:
+        placeholders = ", ".join("?" for _ in points)
+        with self.pool.connection() as connection:
+            rows = connection.execute(
+                f"SELECT point, timestamp, value FROM {self.table} "
+                f"WHERE point IN ({placeholders}) AND timestamp >= ? AND timestamp < ?",
+                (*points, start, end)).fetchall()
+        return align(rows, points)
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+class BulkFetcher:
+    """
+    Reads points from a source in bulk:
+    - the requested points are deduplicated, and points already fetched for the same
+      time range are served from a cache (the last `cache_ranges` time ranges are kept),
+    - the other points are read in batches of `batch_size` points, one ranged read per
+      batch (the default batch size stays below the SQLite limit of 999 query
+      parameters), possibly on `max_workers` threads (e.g. over the pooled connections of a
+      SQLiteSource). Sources with `batched = False` (e.g. a CSVSource, which scans the
+      rows of the range for any number of points) are read in one call instead.
+
+    A BulkFetcher is itself a source, and can be given to execution.stream.
+    """
+    def __init__(self, source, batch_size: int = 500, max_workers: int = 1, cache_ranges: int = 2):
+        self.source = source
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.cache_ranges = cache_ranges
+        self.cache: OrderedDict = OrderedDict()
+        self.reads = 0
+
+    def _fetch(self, points: List[str], start: float, end: float) -> Series:
+        size = self.batch_size if getattr(self.source, 'batched', True) else len(points)
+        batches = [points[i:i + size] for i in range(0, len(points), size)]
+        self.reads += len(batches)
+        if self.max_workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(self.max_workers) as pool:
+                parts = list(pool.map(lambda batch: self.source.read(batch, start, end), batches))
+        else:
+            parts = [self.source.read(batch, start, end) for batch in batches]
+        return merge(parts)
+
+    def read(self, points: List[str], start: float, end: float) -> Series:
+        key = (start, end)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+        else:
+            self.cache[key] = (np.empty(0), {})
+            while len(self.cache) > self.cache_ranges:
+                self.cache.popitem(last=False)
+        timestamps, cached = self.cache[key]
+
+        missing = sorted(set(points) - set(cached))
+        if missing:
+            fetched = self._fetch(missing, start, end)
+            if cached:
+                timestamps, cached = merge([(timestamps, cached), fetched])
+            else:
+                timestamps, cached = fetched[0], dict(fetched[1])
+            self.cache[key] = (timestamps, cached)
+        return timestamps, {point: cached[point] for point in points}
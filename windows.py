@@ -0,0 +1,78 @@
+'''
+Stateful window operators over time series, used by the Window nodes of CQ expressions
+(see SeeQ.Window and SeeQ.evaluate).
+
+Every operator works along the last axis of its input (time), so it applies to a series
+as well as to a (targets x timestamps) matrix (see execution.columnar), and returns its
+result together with a state. Feeding the state back with the next chunk of the series
+gives exactly the result of the operator over the whole series:
+
+    a, state = rolling_mean(x[:100], 5)
+    b, state = rolling_mean(x[100:], 5, state=state)
+    np.concatenate([a, b])  ==  rolling_mean(x, 5)[0]
+
+Windows are counted in samples, so the series are expected to be regularly sampled
+(e.g. "persists for 15 minutes" over 1-minute data is persists(cond, 15)).
+
+Functions:
+- rolling_mean: mean over the last `size` samples (NaN until there are `size` samples)
+-  rolling_min: minimum over the last `size` samples
+-  rolling_max: maximum over the last `size` samples
+-     duration: number of consecutive samples for which a condition has been true
+-     persists: true where a condition has been true for at least `size` samples
+-   hysteresis: true from where x rises above `on` until it falls below `off`
+'''
+from typing import Tuple
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def _rolling(reduce, x, size: int, state=None) -> Tuple[np.ndarray, np.ndarray]:
+    # the state is the last size-1 samples seen, NaN before the start of the series
+    x = np.asarray(x, dtype=float)
+    if state is None:
+        state = np.full(x.shape[:-1] + (size - 1,), np.nan)
+    window = np.concatenate([state, x], axis=-1)
+    if x.shape[-1]:
+        result = reduce(sliding_window_view(window, size, axis=-1), axis=-1)
+    else:
+        result = np.empty(x.shape)
+    return result, window[..., window.shape[-1] - (size - 1):]
+
+def rolling_mean(x, size: int, state=None) -> Tuple[np.ndarray, np.ndarray]:
+    return _rolling(np.mean, x, size, state)
+
+def rolling_min(x, size: int, state=None) -> Tuple[np.ndarray, np.ndarray]:
+    return _rolling(np.min, x, size, state)
+
+def rolling_max(x, size: int, state=None) -> Tuple[np.ndarray, np.ndarray]:
+    return _rolling(np.max, x, size, state)
+
+def duration(condition, state=None) -> Tuple[np.ndarray, np.ndarray]:
+    # the state is the length of the run of true samples at the end of the previous chunk
+    condition = np.asarray(condition, dtype=bool)
+    if state is None:
+        state = np.zeros(condition.shape[:-1], dtype=np.int64)
+    position = np.arange(condition.shape[-1])
+    # position of the last false sample up to each sample, -1 - previous run if there is none
+    start = np.where(condition, -1 - state[..., None], position)
+    last_false = np.maximum.accumulate(start, axis=-1)
+    runs = position - last_false
+    return runs, runs[..., -1] if condition.shape[-1] else state
+
+def persists(condition, size: int, state=None) -> Tuple[np.ndarray, np.ndarray]:
+    runs, state = duration(condition, state)
+    return runs >= size, state
+
+def hysteresis(x, on, off, state=None) -> Tuple[np.ndarray, np.ndarray]:
+    # the state is the output at the end of the previous chunk (false at the start)
+    x = np.asarray(x, dtype=float)
+    if state is None:
+        state = np.zeros(x.shape[:-1], dtype=bool)
+    # 1 where the output switches on, 0 where it switches off, -1 where it holds
+    switch = np.where(x > on, 1, np.where(x < off, 0, -1))
+    position = np.arange(x.shape[-1])
+    last_switch = np.maximum.accumulate(np.where(switch >= 0, position, -1), axis=-1)
+    held = np.take_along_axis(switch, np.maximum(last_switch, 0), axis=-1)
+    result = np.where(last_switch >= 0, held == 1, state[..., None])
+    return result, result[..., -1] if x.shape[-1] else state